@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+
+# Compression of the dense layers of the torch classifiers
+#
+# Loads a FeedforwardNetwork (hw1-q2.py) or CNN (hw2-q2.py) saved with
+# -save_model and compresses its nn.Linear layers (-modules, all but the
+# output layer by default) in two ways, each setting starting over from the
+# trained model:
+#   - iterative magnitude pruning: the smallest weights of every layer are
+#     zeroed in -prune_steps steps up to each -sparsities target, with
+#     -finetune_epochs epochs of training after every step (the pruned
+#     weights stay zero while fine-tuning);
+#   - low-rank factorization: every layer is replaced by the product of two
+#     Linear layers of each -ranks rank, from its truncated SVD, and then
+#     fine-tuned.
+# Prints the parameters and FLOPs per example (both counting nonzero
+# weights only), the CPU latency and the validation and test accuracy of
+# every setting (see quantize.py for how they are measured), along with
+# those of the uncompressed model fine-tuned as long as the pruned ones.
+# Pruned weights are stored and multiplied densely, so pruning lowers the
+# FLOPs counted but not the latency; factorizing lowers both.
+#
+# Example:
+#   (cd hw2/src/cnn && python hw2-q2.py -epochs 5 -save_model cnn.pt)
+#   python compress.py hw2-q2 hw2/src/cnn/cnn.pt -modules fc1 fc2 \
+#       -sparsities 0.5 0.8 0.9 -ranks 128 64 32 -batch_size 256
+
+import argparse
+import copy
+import os
+
+import torch
+from torch import nn
+from torch.nn.utils import prune
+
+import sweep
+from quantize import Classifier
+
+# entry -> the loss its model is trained with
+CRITERIA = {
+    "hw1-q2": nn.CrossEntropyLoss,
+    "hw2-q2": nn.NLLLoss,
+}
+
+
+def linear_modules(model):
+    """Names of the nn.Linear layers of model but the last (output) one."""
+    names = [name for name, module in model.named_modules()
+             if isinstance(module, nn.Linear)]
+    return names[:-1]
+
+
+def count_flops(model, example):
+    """
+    Floating point operations of the Linear and Conv2d layers of model on
+    one example, counting a multiply-add as 2 and skipping zero weights.
+    """
+    flops = []
+
+    def hook(module, inputs, output):
+        nonzero = torch.count_nonzero(module.weight).item()
+        if isinstance(module, nn.Conv2d):
+            nonzero *= output.shape[-2] * output.shape[-1]
+        flops.append(2 * nonzero)
+
+    handles = [module.register_forward_hook(hook) for module in model.modules()
+               if isinstance(module, (nn.Linear, nn.Conv2d))]
+    with torch.inference_mode():
+        model(example)
+    for handle in handles:
+        handle.remove()
+    return sum(flops)
+
+
+def count_parameters(model):
+    return sum(torch.count_nonzero(p).item() for p in model.parameters())
+
+
+def factorize(linear, rank):
+    """
+    The nn.Linear linear as two Linear layers through a rank-dimensional
+    bottleneck, from its truncated SVD: W = U S Vh ~ (U_r S_r^1/2)(S_r^1/2 Vh_r).
+    """
+    U, S, Vh = torch.linalg.svd(linear.weight.detach(), full_matrices=False)
+    root = S[:rank].sqrt()
+    first = nn.Linear(linear.in_features, rank, bias=False)
+    second = nn.Linear(rank, linear.out_features, bias=linear.bias is not None)
+    with torch.no_grad():
+        first.weight.copy_(root[:, None] * Vh[:rank])
+        second.weight.copy_(U[:, :rank] * root)
+        if linear.bias is not None:
+            second.bias.copy_(linear.bias)
+    return nn.Sequential(first, second)
+
+
+def replace_module(model, name, module):
+    parent, _, attr = name.rpartition('.')
+    setattr(model.get_submodule(parent), attr, module)
+
+
+class Compressor(object):
+    """Fine-tunes copies of the trained model of a Classifier."""
+
+    def __init__(self, task, criterion, opt):
+        self.task = task
+        self.criterion = criterion
+        self.opt = opt
+        utils = task.utils
+        self.train_dataloader = utils.batch_loader(
+            task.dataset, task.opt.batch_size, shuffle=True)
+
+    def finetune(self, model):
+        task = self.task
+        optims = {"adam": torch.optim.Adam, "sgd": torch.optim.SGD}
+        optimizer = optims[task.opt.optimizer](
+            model.parameters(), lr=self.opt.learning_rate or task.opt.learning_rate,
+            weight_decay=task.opt.l2_decay)
+        model.train()
+        for _ in range(self.opt.finetune_epochs):
+            for X_batch, y_batch in self.train_dataloader:
+                task.module.train_batch(X_batch, y_batch, model, optimizer,
+                                        self.criterion)
+        model.eval()
+
+    def dense(self):
+        """
+        A copy of the model fine-tuned as long as prune() does, without
+        compressing it, to tell the gains of compression from those of the
+        extra training.
+        """
+        self.task.utils.configure_seed(seed=42)
+        model = copy.deepcopy(self.task.model)
+        for _ in range(self.opt.prune_steps):
+            self.finetune(model)
+        return model
+
+    def prune(self, sparsity):
+        """
+        A copy of the model with sparsity of the weights of every compressed
+        layer pruned, the same fraction of the remaining weights at each step.
+        """
+        self.task.utils.configure_seed(seed=42)
+        model = copy.deepcopy(self.task.model)
+        step_amount = 1 - (1 - sparsity) ** (1 / self.opt.prune_steps)
+        for _ in range(self.opt.prune_steps):
+            for name in self.opt.modules:
+                prune.l1_unstructured(model.get_submodule(name), 'weight',
+                                      amount=step_amount)
+            self.finetune(model)
+        for name in self.opt.modules:
+            prune.remove(model.get_submodule(name), 'weight')
+        return model
+
+    def factorize(self, rank):
+        """A copy of the model with every compressed layer factorized."""
+        self.task.utils.configure_seed(seed=42)
+        model = copy.deepcopy(self.task.model)
+        for name in self.opt.modules:
+            linear = model.get_submodule(name)
+            if rank < min(linear.in_features, linear.out_features):
+                replace_module(model, name, factorize(linear, rank))
+        self.finetune(model)
+        return model
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('entry', choices=sorted(CRITERIA))
+    parser.add_argument('checkpoint',
+                        help="A model saved with the entry's -save_model flag")
+    parser.add_argument('-modules', nargs='+',
+                        help="""Names of the nn.Linear layers to compress
+                        (e.g. fc1 fc2 for the CNN, layers.0 layers.3 for
+                        the FeedforwardNetwork); all but the output layer
+                        by default""")
+    parser.add_argument('-sparsities', type=float, nargs='*',
+                        default=[0.5, 0.8, 0.9],
+                        help="Fractions of the weights to prune")
+    parser.add_argument('-prune_steps', type=int, default=3,
+                        help="Pruning rounds to reach each sparsity")
+    parser.add_argument('-ranks', type=int, nargs='*', default=[128, 64, 32],
+                        help="Ranks of the factorized layers")
+    parser.add_argument('-finetune_epochs', type=int, default=1,
+                        help="""Training epochs after every pruning step and
+                        after factorizing""")
+    parser.add_argument('-learning_rate', type=float,
+                        help="""Fine-tuning learning rate, the one the model
+                        was trained with by default""")
+    parser.add_argument('-batch_size', type=int, default=1,
+                        help="Examples per call in the latency")
+    parser.add_argument('-latency_batches', type=int, default=500,
+                        help="""Number of validation batches the latency is
+                        averaged over""")
+    parser.add_argument('-threads', type=int, default=torch.get_num_threads())
+    opt = parser.parse_args()
+
+    torch.set_num_threads(opt.threads)
+    checkpoint = torch.load(opt.checkpoint)
+
+    # The scripts read their data relative to their directory
+    os.chdir(os.path.join(sweep.ROOT, sweep.ENTRIES[opt.entry].dir))
+    module = sweep.import_entry(opt.entry)
+    model_opt = module.build_parser().parse_args(checkpoint["argv"])
+    if opt.entry == "hw1-q2" and model_opt.model != "mlp":
+        parser.error("compress.py compresses the hidden layers of the mlp")
+    task = Classifier(opt.entry, module, model_opt, checkpoint["state_dict"])
+
+    names = linear_modules(task.model)
+    if opt.modules is None:
+        opt.modules = names
+    for name in opt.modules:
+        if name not in names:
+            parser.error("-modules: {} is not a hidden nn.Linear layer, "
+                         "choose from {}".format(name, " ".join(names)))
+
+    compressor = Compressor(task, CRITERIA[opt.entry](), opt)
+    settings = [("trained", task.model), ("finetuned", compressor.dense())]
+    for sparsity in opt.sparsities:
+        settings.append(("prune {:g}".format(sparsity), compressor.prune(sparsity)))
+    for rank in opt.ranks:
+        settings.append(("rank {}".format(rank), compressor.factorize(rank)))
+
+    example = task.utils.normalize_pixels(task.dataset.dev_X[:1])
+    print('{:<11} {:>10} {:>9} {:>13} {:>8} {:>8} {:>10}'.format(
+        'setting', 'params', 'MFLOPs', 'latency (ms)', 'valid', 'test', 'test diff'))
+    baseline = None
+    for setting, model in settings:
+        valid, test = task.scores(model)
+        if baseline is None:
+            baseline = test
+        print('{:<11} {:>10} {:>9.3f} {:>13.3f} {:>8.4f} {:>8.4f} {:>+10.4f}'.format(
+            setting, count_parameters(model), count_flops(model, example) / 1e6,
+            task.latency(model, opt.latency_batches, opt.batch_size) * 1000,
+            valid, test, test - baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+# Data-parallel scaling report for hw1-q2.py and hw2-q2.py
+#
+# Trains the FeedforwardNetwork of hw1-q2.py and the CNN of hw2-q2.py with
+# -nproc 1, 2, 4 and 8 gloo processes (see utils.launch()), one run at a
+# time in a fresh process, and prints the wall time of every run, its
+# speedup over a single process and its final training loss and validation
+# and test accuracy. -batch_size is the batch of all the processes
+# together, so it must be a multiple of every -nproc. The torch threads of
+# a run (-threads) are split between its processes. The times include
+# starting the processes and loading the data in each of them.
+#
+# Example:
+#   python distributed_report.py -entries hw2-q2 -nprocs 1 2 4 8 -epochs 5
+
+import argparse
+import os
+
+import sweep
+
+# entry -> the config trained
+RUNS = {
+    "hw1-q2": {"model": "mlp"},
+    "hw2-q2": {},
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-entries', nargs='+', choices=sorted(RUNS),
+                        default=sorted(RUNS))
+    parser.add_argument('-nprocs', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help="Numbers of processes to train with.")
+    parser.add_argument('-batch_size', type=int, default=64,
+                        help="Batch size of every run, over all its processes.")
+    parser.add_argument('-epochs', type=int, default=2,
+                        help="Epochs of every run.")
+    parser.add_argument('-threads', type=int, default=os.cpu_count(),
+                        help="Number of threads every run may use.")
+    opt = parser.parse_args()
+    for nproc in opt.nprocs:
+        if opt.batch_size % nproc:
+            parser.error('-batch_size must be a multiple of every -nprocs')
+
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(opt.threads)
+    os.environ["MPLBACKEND"] = "Agg"
+
+    print('{:<8} {:>6} {:>9} {:>8} {:>11} {:>8} {:>8}'.format(
+        'entry', 'nproc', 'time (s)', 'speedup', 'train loss', 'valid', 'test'))
+    for name in opt.entries:
+        entry = sweep.ENTRIES[name]
+        baseline = None
+        for nproc in opt.nprocs:
+            config = dict(RUNS[name])
+            config.update({entry.epochs: opt.epochs, "batch_size": opt.batch_size,
+                           "nproc": nproc})
+            result = sweep.run_alone((name, sweep.to_argv(entry, config), None), opt.threads)
+            if baseline is None:
+                baseline = result["seconds"]
+            print('{:<8} {:>6} {:>9.1f} {:>7.2f}x {:>11.4f} {:>8.4f} {:>8.4f}'.format(
+                name, nproc, result["seconds"], baseline / result["seconds"],
+                result["train_losses"][-1], result["valid_accs"][-1],
+                result["test_acc"]), flush=True)
+
+
+if __name__ == '__main__':
+    main()
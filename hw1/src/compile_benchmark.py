@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+# Deep Learning Homework 1
+#
+# Training and evaluation throughput (examples per second) of the hw1-q2.py
+# FeedforwardNetwork in each -execution mode (eager, TorchScript and
+# torch.compile) for several batch sizes, on seeded synthetic data shaped
+# like Kuzushiji-MNIST. Compilation happens in a warm-up epoch that is not
+# timed.
+#
+# Example:
+#   python compile_benchmark.py -batch_sizes 16 64 256 -layers 2
+
+import argparse
+import importlib
+
+import torch
+from torch import nn
+
+import utils
+from loader_benchmark import N_CLASSES, N_FEATURES, synthetic_data
+
+hw1_q2 = importlib.import_module("hw1-q2")
+
+
+def train_epoch(batches, model, optimizer, criterion):
+    for X_batch, y_batch in batches:
+        hw1_q2.train_batch(X_batch, y_batch, model, optimizer, criterion)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    # torch.compile only exists from torch 2.0 on
+    executions = ['eager', 'script']
+    if hasattr(torch, 'compile'):
+        executions.append('compile')
+    parser.add_argument('-executions', nargs='+', choices=executions,
+                        default=executions)
+    parser.add_argument('-batch_sizes', type=int, nargs='+', default=[16, 64, 256])
+    parser.add_argument('-hidden_size', type=int, default=200)
+    parser.add_argument('-layers', type=int, default=2)
+    parser.add_argument('-activation', choices=['tanh', 'relu'], default='relu')
+    parser.add_argument('-dropout', type=float, default=0.3)
+    parser.add_argument('-n_train', type=int, default=20000,
+                        help="Number of synthetic examples per epoch.")
+    parser.add_argument('-repeats', type=int, default=3,
+                        help="Each measurement keeps the fastest of this many runs.")
+    parser.add_argument('-threads', type=int, default=torch.get_num_threads())
+    opt = parser.parse_args()
+
+    torch.set_num_threads(opt.threads)
+    data = synthetic_data(opt.n_train)
+    dataset = utils.ClassificationDataset(data)
+
+    print('{:<8} {:>6} {:>14} {:>14} {:>14}'.format(
+        'mode', 'batch', 'train (ex/s)', 'eval (ex/s)', 'train speedup'))
+    for batch_size in opt.batch_sizes:
+        baseline = None
+        for execution in opt.executions:
+            utils.configure_seed(seed=42)
+            model = hw1_q2.FeedforwardNetwork(
+                N_CLASSES, N_FEATURES, opt.hidden_size, opt.layers,
+                opt.activation, opt.dropout)
+            model.compile_layers(execution)
+            optimizer = torch.optim.SGD(model.parameters(), lr=0.01)
+            criterion = nn.CrossEntropyLoss()
+            batches = utils.TensorBatchIterator(dataset.X, dataset.y, batch_size)
+
+            def train():
+                train_epoch(batches, model, optimizer, criterion)
+
+            def evaluate():
+                hw1_q2.evaluate(model, dataset.X, dataset.y)
+
+            # Warm-up: compiles for the training and evaluation shapes
+            train()
+            evaluate()
+            train_rate = opt.n_train / utils.best_time(train, opt.repeats)
+            eval_rate = opt.n_train / utils.best_time(evaluate, opt.repeats)
+            if baseline is None:
+                baseline = train_rate
+            print('{:<8} {:>6} {:>14.0f} {:>14.0f} {:>13.2f}x'.format(
+                execution, batch_size, train_rate, eval_rate, train_rate / baseline))
+
+
+if __name__ == '__main__':
+    main()
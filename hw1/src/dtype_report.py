@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+# Deep Learning Homework 1
+#
+# Trains the numpy models of hw1-q1.py with float64 and float32 data and
+# parameters and prints the training time, evaluation time and accuracies
+# of both precisions side by side.
+
+import argparse
+import importlib
+import time
+
+import numpy as np
+
+import utils
+
+hw1_q1 = importlib.import_module("hw1-q1")
+
+
+def build_model(name, n_classes, n_feats, dtype, opt):
+    if name == 'perceptron':
+        return hw1_q1.Perceptron(n_classes, n_feats, dtype=dtype)
+    if name == 'averaged_perceptron':
+        return hw1_q1.AveragedPerceptron(n_classes, n_feats, dtype=dtype)
+    if name == 'logistic_regression':
+        return hw1_q1.LogisticRegression(n_classes, n_feats, dtype=dtype)
+    return hw1_q1.MLP(n_classes, n_feats, opt.hidden_size, layers=opt.layers,
+                      dtype=dtype)
+
+
+def run(name, dtype, opt):
+    """
+    Trains one model for opt.epochs epochs and returns a dict with the mean
+    seconds per training epoch, the seconds of the last dev+test evaluation
+    and the final dev and test accuracies.
+    """
+    utils.configure_seed(seed=42)
+    data = utils.load_classification_data(bias=name != 'mlp', dtype=dtype)
+    train_X, train_y = data["train"]
+    dev_X, dev_y = data["dev"]
+    test_X, test_y = data["test"]
+
+    n_classes = np.unique(train_y).size
+    model = build_model(name, n_classes, train_X.shape[1], dtype, opt)
+
+    train_batches = utils.BatchIterator(train_X, train_y, opt.batch_size)
+    train_time = 0.0
+    for _ in range(opt.epochs):
+        train_batches.shuffle()
+        start = time.perf_counter()
+        model.train_batches(train_batches, learning_rate=opt.learning_rate)
+        train_time += time.perf_counter() - start
+
+    start = time.perf_counter()
+    dev_acc = model.evaluate(dev_X, dev_y)
+    test_acc = model.evaluate(test_X, test_y)
+    eval_time = time.perf_counter() - start
+
+    return {"train": train_time / opt.epochs, "eval": eval_time,
+            "dev": dev_acc, "test": test_acc}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('models', nargs='+',
+                        choices=['perceptron', 'averaged_perceptron',
+                                 'logistic_regression', 'mlp'],
+                        help="Which models should be compared?")
+    parser.add_argument('-epochs', default=2, type=int)
+    parser.add_argument('-hidden_size', type=int, default=200)
+    parser.add_argument('-layers', type=int, default=1)
+    parser.add_argument('-learning_rate', type=float, default=0.001)
+    parser.add_argument('-batch_size', type=int, default=1)
+    opt = parser.parse_args()
+
+    print('{:<20} {:<8} {:>10} {:>10} {:>8} {:>8}'.format(
+        'model', 'dtype', 'epoch (s)', 'eval (s)', 'dev', 'test'))
+    for name in opt.models:
+        results = {}
+        for dtype in ('float64', 'float32'):
+            results[dtype] = run(name, dtype, opt)
+            r = results[dtype]
+            print('{:<20} {:<8} {:>10.3f} {:>10.3f} {:>8.4f} {:>8.4f}'.format(
+                name, dtype, r["train"], r["eval"], r["dev"], r["test"]))
+        print('{:<20} float32 speedup: train {:.2f}x, eval {:.2f}x, '
+              'dev acc change {:+.4f}'.format(
+                  name,
+                  results['float64']["train"] / results['float32']["train"],
+                  results['float64']["eval"] / results['float32']["eval"],
+                  results['float32']["dev"] - results['float64']["dev"]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+# Deep Learning Homework 1
+#
+# Measures how Hogwild! training of the hw1-q1.py perceptron and logistic
+# regression scales with the number of worker processes: training
+# throughput (examples per second) and the dev accuracy reached.
+
+import argparse
+import importlib
+import time
+
+import numpy as np
+
+import utils
+
+hw1_q1 = importlib.import_module("hw1-q1")
+
+
+def run(model_name, workers, data, opt):
+    utils.configure_seed(seed=42)
+    train_X, train_y = data["train"]
+    dev_X, dev_y = data["dev"]
+
+    n_classes = np.unique(train_y).size
+    if model_name == 'perceptron':
+        model = hw1_q1.Perceptron(n_classes, train_X.shape[1], dtype=opt.dtype)
+    else:
+        model = hw1_q1.LogisticRegression(n_classes, train_X.shape[1], dtype=opt.dtype)
+
+    train_batches = utils.BatchIterator(train_X, train_y, opt.batch_size)
+    train_time = 0.0
+    for _ in range(opt.epochs):
+        train_batches.shuffle()
+        start = time.perf_counter()
+        model.train_batches(train_batches, learning_rate=opt.learning_rate,
+                            workers=workers)
+        train_time += time.perf_counter() - start
+
+    throughput = opt.epochs * train_X.shape[0] / train_time
+    return throughput, model.evaluate(dev_X, dev_y)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model', choices=['perceptron', 'logistic_regression'])
+    parser.add_argument('-workers', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help="Worker counts to compare.")
+    parser.add_argument('-epochs', default=3, type=int)
+    parser.add_argument('-learning_rate', type=float, default=0.001)
+    parser.add_argument('-batch_size', type=int, default=1)
+    parser.add_argument('-dtype', choices=['float64', 'float32'], default='float64')
+    opt = parser.parse_args()
+
+    data = utils.load_classification_data(bias=True, dtype=opt.dtype)
+
+    print('{:>8} {:>14} {:>9} {:>8}'.format('workers', 'examples/s', 'speedup', 'dev acc'))
+    base = None
+    for workers in opt.workers:
+        throughput, dev_acc = run(opt.model, workers, data, opt)
+        base = base or throughput
+        print('{:>8} {:>14.0f} {:>8.2f}x {:>8.4f}'.format(
+            workers, throughput, throughput / base, dev_acc))
+
+
+if __name__ == '__main__':
+    main()
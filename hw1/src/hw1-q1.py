@@ -3,11 +3,13 @@
 # Deep Learning Homework 1
 
 import argparse
+import multiprocessing
 import random
 import os
 
 import numpy as np
 import matplotlib.pyplot as plt
+from scipy import linalg, sparse
 
 import utils
 
@@ -19,19 +21,114 @@ def configure_seed(seed):
 
 
 class LinearModel(object):
-    def __init__(self, n_classes, n_features, **kwargs):
-        self.W: np.ndarray = np.zeros((n_classes, n_features))
+    def __init__(self, n_classes, n_features, dtype=np.float64, **kwargs):
+        # dtype -> float precision of the weights; inputs are cast to it so
+        # that mixing precisions never silently upcasts to float64.
+        self.W: np.ndarray = np.zeros((n_classes, n_features), dtype=dtype)
 
     def update_weight(self, x_i, y_i, **kwargs):
         raise NotImplementedError
 
-    def train_epoch(self, X: np.ndarray, y: np.ndarray, **kwargs):
-        for x_i, y_i in zip(X, y):
-            self.update_weight(x_i, y_i, **kwargs)
+    def update_weight_sparse(self, indices, values, y_i, **kwargs):
+        """
+        indices (nnz): the features of one example that are not zero
+        values (nnz): the values of those features
+        y_i (scalar): the gold label for that example
+
+        Same update as update_weight(), touching only the columns of W in
+        indices.
+        """
+        raise NotImplementedError
+
+    def train_epoch(self, X: np.ndarray, y: np.ndarray, batch_size=1, **kwargs):
+        """
+        X (n_examples x n_features): a dense array or a scipy sparse matrix
+        y (n_examples): gold labels
+        batch_size (int): size of the batches fed to train_batches()
+
+        Trains on the examples in the order they are in.
+        """
+        self.train_batches(utils.BatchIterator(X, y, batch_size, dtype=self.W.dtype), **kwargs)
+
+    def train_batches(self, batches, workers=1, **kwargs):
+        """
+        batches: a utils.BatchIterator over the training set
+        workers (int): more than 1 trains with hogwild_epoch()
+
+        Runs update_weight() (update_weight_sparse() for sparse features) on
+        every example of every batch.
+        """
+        if workers > 1:
+            self.hogwild_epoch(batches, workers, **kwargs)
+            return
+        for X_batch, y_batch in batches:
+            X_batch = X_batch.astype(self.W.dtype, copy=False)
+            if sparse.issparse(X_batch):
+                X_batch = X_batch.tocsr()
+                for i, y_i in enumerate(y_batch):
+                    start, end = X_batch.indptr[i], X_batch.indptr[i + 1]
+                    self.update_weight_sparse(
+                        X_batch.indices[start:end], X_batch.data[start:end], y_i, **kwargs)
+            else:
+                for x_i, y_i in zip(X_batch, y_batch):
+                    self.update_weight(x_i, y_i, **kwargs)
+
+    def share_memory(self):
+        """
+        Moves W into memory that stays shared with forked child processes, so
+        that their in-place updates are seen by this process.
+        """
+        if getattr(self, "shared_W", None) is self.W:
+            return
+        raw = multiprocessing.RawArray('b', self.W.nbytes)
+        W = np.frombuffer(raw, dtype=self.W.dtype).reshape(self.W.shape)
+        W[...] = self.W
+        self.W = self.shared_W = W
+
+    def hogwild_epoch(self, batches, workers, **kwargs):
+        """
+        batches: a utils.BatchIterator over the training set
+        workers (int): number of worker processes
+
+        Hogwild! training (Niu et al., 2011): the examples are split into
+        `workers` disjoint shards and each one is trained on by a forked
+        process running the usual train_batches(), all of them updating the
+        shared W in place without any locking. Forked workers read X without
+        copying it. Needs the "fork" start method (Linux).
+        """
+        self.share_memory()
+        ctx = multiprocessing.get_context("fork")
+        processes = [
+            ctx.Process(target=self.train_batches, args=(shard,), kwargs=kwargs)
+            for shard in batches.shards(workers)
+        ]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+        if any(p.exitcode != 0 for p in processes):
+            raise RuntimeError("a hogwild worker failed")
+
+    def prediction_weights(self):
+        """The weights used by predict()"""
+        return self.W
 
     def predict(self, X):
-        """X (n_examples x n_features)"""
-        scores = np.dot(self.W, X.T)  # (n_classes x n_examples)
+        """
+        X (n_examples x n_features): a dense array, a scipy sparse matrix or
+            utils.QuantizedFeatures
+        """
+        W = self.prediction_weights()
+        if isinstance(X, utils.QuantizedFeatures):
+            # Normalized 1000 rows at a time rather than all at once
+            return np.concatenate([
+                self.predict(X.rows(slice(start, start + 1000), W.dtype))
+                for start in range(0, X.shape[0], 1000)])
+        X = X.astype(W.dtype, copy=False)
+        if sparse.issparse(X):
+            scores = X.dot(W.T).T  # only multiplies the nonzero features
+        else:
+            scores = np.dot(W, X.T)  # (n_classes x n_examples)
         predicted_labels = scores.argmax(axis=0)  # (n_examples)
         return predicted_labels
 
@@ -62,168 +159,428 @@ class Perceptron(LinearModel):
         # Q1.1a
 
         # 1st -> Predicts value for this x instance (y_hat)
-        y_hat_i = self.predict(x_i)
+        y_hat_i = self.predict_one(x_i)
         
         # 2st -> If the predicted value is different from the correct one, we update the weights
         if y_hat_i != y_i:
-            predicted = np.multiply(self.LEARNING_RATE, x_i.T)
-            self.W[y_i,:] = self.W[y_i,:] + predicted
-            self.W[y_hat_i,:] = self.W[y_hat_i,:] - predicted
+            predicted = np.multiply(self.LEARNING_RATE, x_i)
+            self.W[y_i] += predicted
+            self.W[y_hat_i] -= predicted
+
+    def update_weight_sparse(self, indices, values, y_i, **kwargs):
+        y_hat_i = self.W[:, indices].dot(values).argmax()
+        if y_hat_i != y_i:
+            predicted = np.multiply(self.LEARNING_RATE, values)
+            self.W[y_i, indices] += predicted
+            self.W[y_hat_i, indices] -= predicted
+
+    def predict_one(self, x_i):
+        """x_i (n_features): scores a single example with one W.x product"""
+        return self.W.dot(x_i).argmax()
+
+
+class AveragedPerceptron(Perceptron):
+    """
+    Perceptron whose predictions use the average of the weight vectors over
+    all training steps. Instead of summing W after each example, every update
+    is also added to U scaled by the step counter c at the time of the
+    update; the average is then W - U / c, so averaging only costs extra
+    row updates on mistakes.
+    """
+
+    def __init__(self, n_classes, n_features, **kwargs):
+        super().__init__(n_classes, n_features, **kwargs)
+        self.U = np.zeros_like(self.W)
+        self.c = 1
+
+    def hogwild_epoch(self, batches, workers, **kwargs):
+        # The step counter c of the lazy average is private to each process.
+        raise ValueError("the averaged perceptron cannot be trained with hogwild")
+
+    def update_weight(self, x_i, y_i, **kwargs):
+        """
+        x_i (n_features): a single training example
+        y_i (scalar): the gold label for that example
+        other arguments are ignored
+        """
+        y_hat_i = self.predict_one(x_i)
+        if y_hat_i != y_i:
+            predicted = np.multiply(self.LEARNING_RATE, x_i)
+            self.W[y_i] += predicted
+            self.W[y_hat_i] -= predicted
+            predicted *= self.c
+            self.U[y_i] += predicted
+            self.U[y_hat_i] -= predicted
+        self.c += 1
+
+    def update_weight_sparse(self, indices, values, y_i, **kwargs):
+        y_hat_i = self.W[:, indices].dot(values).argmax()
+        if y_hat_i != y_i:
+            predicted = np.multiply(self.LEARNING_RATE, values)
+            self.W[y_i, indices] += predicted
+            self.W[y_hat_i, indices] -= predicted
+            predicted *= self.c
+            self.U[y_i, indices] += predicted
+            self.U[y_hat_i, indices] -= predicted
+        self.c += 1
+
+    def prediction_weights(self):
+        return self.W - self.U / self.c
+
 
 class LogisticRegression(LinearModel):
 
-    def update_weight(self, x_i, y_i, learning_rate=0.001):
+    def update_weight(self, x_i, y_i, learning_rate=0.001, **kwargs):
         """
         x_i (n_features): a single training example
         y_i: the gold label for that example
         learning_rate (float): keep it at the default value for your plots
+        other arguments are ignored
         """
         # Q1.1b
 
-        # Label scores according to the model (num_labels x 1).
-        label_scores = self.W.dot(x_i)[:, None]
-        # One-hot vector with the true label (num_labels x 1).
-        y_one_hot = np.zeros((np.size(self.W, 0), 1))
-        y_one_hot[y_i] = 1
-        
-        # Softmax function.
-        # This gives the label probabilities according to the model (num_labels x 1).
-        label_probabilities = np.exp(label_scores) / np.sum(np.exp(label_scores))
+        # Label scores according to the model (1 x num_labels).
+        label_scores = self.W.dot(x_i)[None, :]
+        # Gradient of the loss wrt the scores, label probabilities minus the
+        # one-hot gold label (num_labels).
+        grad_z = self.softmax_gradient(label_scores, [y_i], [0])[0]
         # SGD update. W is num_labels x num_features.
-        self.W += learning_rate * (y_one_hot - label_probabilities) * x_i[None, :]
+        self.W -= learning_rate * np.outer(grad_z, x_i)
+
+    def update_weight_sparse(self, indices, values, y_i, learning_rate=0.001,
+                             **kwargs):
+        # Only the columns of the nonzero features take part in the scores
+        # and receive a gradient.
+        label_scores = self.W[:, indices].dot(values)
+        grad_z = self.softmax_gradient(label_scores[None, :], [y_i], [0])[0]
+        self.W[:, indices] -= learning_rate * np.outer(grad_z, values)
+
+    def softmax_gradient(self, scores, y, rows):
+        """
+        scores (batch_size x n_classes): W.x for each example, overwritten
+        y (batch_size): gold labels
+        rows (batch_size): np.arange(batch_size)
+
+        Turns the scores into the gradient of the cross-entropy wrt them,
+        softmax(scores) - one_hot(y), in place. The row max is subtracted
+        before exponentiating (log-sum-exp trick) so large scores cannot
+        overflow.
+        """
+        scores -= scores.max(axis=1, keepdims=True)
+        np.exp(scores, out=scores)
+        scores /= scores.sum(axis=1, keepdims=True)
+        scores[rows, y] -= 1
+        return scores
+
+    def train_batches(self, batches, learning_rate=0.001, workers=1, **kwargs):
+        """
+        batches: a utils.BatchIterator over the training set
+        learning_rate (float): step size of a single per-example update
+        workers (int): more than 1 trains with hogwild_epoch()
+
+        Batches of one example use the per-example update_weight(); larger
+        batches update W once per mini-batch with the summed gradient, i.e.
+        the averaged gradient with the step scaled by the batch size.
+        """
+        if workers > 1:
+            self.hogwild_epoch(batches, workers, learning_rate=learning_rate)
+            return
+        if batches.batch_size == 1:
+            super().train_batches(batches, learning_rate=learning_rate)
+            return
+
+        grad_W = np.empty_like(self.W)
+        scores = np.empty((batches.batch_size, self.W.shape[0]), dtype=self.W.dtype)
+        rows = np.arange(batches.batch_size)
+        for X_batch, y_batch in batches:
+            X_batch = X_batch.astype(self.W.dtype, copy=False)
+            n = X_batch.shape[0]
+            if sparse.issparse(X_batch):
+                scores[:n] = X_batch.dot(self.W.T)
+                grad_z = self.softmax_gradient(scores[:n], y_batch, rows[:n])
+                grad_W[:] = X_batch.T.dot(grad_z).T
+            else:
+                np.dot(X_batch, self.W.T, out=scores[:n])
+                grad_z = self.softmax_gradient(scores[:n], y_batch, rows[:n])
+                np.dot(grad_z.T, X_batch, out=grad_W)
+            grad_W *= learning_rate
+            self.W -= grad_W
+
+
+class LinearRegression(LinearModel):
+
+    def __init__(self, n_features, dtype=np.float64, **kwargs):
+        # A single row of weights: W[0].x is the predicted value
+        super().__init__(1, n_features, dtype=dtype)
+
+    def update_weight(self, x_i, y_i, learning_rate=0.001, **kwargs):
+        """
+        x_i (n_features): a single training example
+        y_i (scalar): its target value
+        learning_rate (float): step size
+
+        SGD step on the squared error (y_i - w.x_i)^2 / 2.
+        """
+        w = self.W[0]
+        w += learning_rate * (y_i - w.dot(x_i)) * x_i
+
+    def update_weight_sparse(self, indices, values, y_i, learning_rate=0.001,
+                             **kwargs):
+        w = self.W[0]
+        w[indices] += learning_rate * (y_i - w[indices].dot(values)) * values
+
+    def train_batches(self, batches, learning_rate=0.001, workers=1, **kwargs):
+        """
+        batches: a utils.BatchIterator over the training set
+        learning_rate (float): step size of a single per-example update
+        workers (int): more than 1 trains with hogwild_epoch()
+
+        SGD with update_weight() for batches of one example, otherwise one
+        step per mini-batch with the summed gradient (as in
+        LogisticRegression).
+        """
+        if workers > 1:
+            self.hogwild_epoch(batches, workers, learning_rate=learning_rate)
+            return
+        if batches.batch_size == 1:
+            super().train_batches(batches, learning_rate=learning_rate)
+            return
+        w = self.W[0]
+        for X_batch, y_batch in batches:
+            X_batch = X_batch.astype(self.W.dtype, copy=False)
+            residuals = y_batch - X_batch.dot(w)
+            w += learning_rate * X_batch.T.dot(residuals)
+
+    def fit(self, batches, l2_penalty=0.0):
+        """
+        batches: a utils.BatchIterator over the training set (its order does
+            not matter)
+        l2_penalty (float): ridge regularization, 0 for least squares
+
+        Sets W to the exact minimizer of ||Xw - y||^2 + l2_penalty ||w||^2 in
+        a single pass: X^T X and X^T y are summed one batch at a time, so only
+        a batch of X is ever in memory (e.g. read from an -mmap cache), and
+        (X^T X + l2_penalty I) w = X^T y is solved by Cholesky factorization.
+        The sums are kept in float64 whatever the dtype. Raises
+        numpy.linalg.LinAlgError if X^T X is singular and l2_penalty is 0.
+        """
+        n_features = self.W.shape[1]
+        XtX = np.zeros((n_features, n_features))
+        Xty = np.zeros(n_features)
+        for X_batch, y_batch in batches:
+            X_batch = X_batch.astype(np.float64, copy=False)
+            XtX += X_batch.T.dot(X_batch)
+            Xty += X_batch.T.dot(y_batch)
+        XtX[np.diag_indices(n_features)] += l2_penalty
+        self.W[0] = linalg.cho_solve(linalg.cho_factor(XtX), Xty)
+
+    def predict(self, X):
+        """X (n_examples x n_features): a dense array or a scipy sparse matrix"""
+        return X.dot(self.W[0])
+
+    def evaluate(self, X, y):
+        """
+        X (n_examples x n_features)
+        y (n_examples): target values
+
+        Returns the root mean squared error (lower is better).
+        """
+        return np.sqrt(np.mean((self.predict(X) - y) ** 2))
+
+
+class MLPWorkspace(object):
+    """
+    Buffers used by one forward/backward pass of an MLP over a batch of
+    batch_size examples. They are allocated once and overwritten in place on
+    every step, so training does not allocate arrays per example or batch.
+    """
+    def __init__(self, units, batch_size, dtype=np.float64):
+        num_layers = len(units) - 1
+        # activations[i] -> output of layer i (batch_size x units[i+1]); the
+        # last one holds the softmax probabilities.
+        self.activations = [np.empty((batch_size, units[i+1]), dtype=dtype) for i in range(num_layers)]
+        # deltas[i] -> grad of the loss wrt the pre-activation of layer i
+        self.deltas = [np.empty((batch_size, units[i+1]), dtype=dtype) for i in range(num_layers)]
+        # masks[i] -> where the ReLU of hidden layer i was active
+        self.masks = [np.empty((batch_size, units[i+1]), dtype=bool) for i in range(num_layers - 1)]
+        self.row_buffer = np.empty((batch_size, 1), dtype=dtype)
+        self.rows = np.arange(batch_size)
+
 
 class MLP(object):
     # Q3.2b. This MLP skeleton code allows the MLP to be used in place of the
     # linear models with no changes to the training loop or evaluation code
     # in main().
-    def __init__(self, n_classes, n_features, hidden_size):
-        # Initialize an MLP with a single hidden layer.
+    def __init__(self, n_classes, n_features, hidden_size, layers=1,
+                 eval_chunk_size=1000, dtype=np.float64):
+        # Initialize an MLP with `layers` hidden layers of `hidden_size` units.
+        # eval_chunk_size -> number of rows pushed through predict() at a time
+        # dtype -> float precision of parameters, buffers and inputs
 
         # n_classes -> 10
         # n_features -> 784
 
-        units = [n_features, hidden_size + 1, n_classes]
+        self.units = [n_features] + [hidden_size] * layers + [n_classes]
         # # First is input size, last is output size.
 
-        # Initialize all weights and biases randomly.
-        self.W1 = np.random.normal(0.1, 0.1, (units[1], units[0]))
-        self.b1 = np.zeros(units[1])
-        
-        self.W2 = np.random.normal(0.1, 0.1, (units[2], units[1]))
-        self.b2 = np.zeros(units[2])
-
-        self.weights = [self.W1, self.W2]
-        self.biases = [self.b1, self.b2]
-        self.activation_func = [self.relu, self.softmax]
-
-    def relu(self, val):
-        def inner(out):
-            return max(0.0, out)
-        return np.vectorize(inner)(val)
-
-    def softmax(self, vals):
-        f = vals - np.max(vals)
-        return np.exp(f) / np.sum(np.exp(f))
-
-    def predict(self, X):
+        # Initialize all weights randomly and biases to zero. He init
+        # (zero mean, variance 2 / fan_in) keeps the scale of the ReLU
+        # activations from growing with depth.
+        self.dtype = np.dtype(dtype)
+        self.weights = [
+            np.random.normal(0, np.sqrt(2 / self.units[i]),
+                             (self.units[i+1], self.units[i])).astype(self.dtype)
+            for i in range(len(self.units) - 1)
+        ]
+        self.biases = [np.zeros(self.units[i+1], dtype=self.dtype) for i in range(len(self.units) - 1)]
+
+        # Gradients do not depend on the batch size, so one set is enough.
+        self.grad_weights = [np.empty_like(w) for w in self.weights]
+        self.grad_biases = [np.empty_like(b) for b in self.biases]
+
+        # batch_size -> MLPWorkspace. An epoch needs at most two: one for the
+        # full batches and one for the smaller last batch.
+        self.workspaces = {}
+        self.eval_chunk_size = eval_chunk_size
+
+    def workspace(self, batch_size):
+        if batch_size not in self.workspaces:
+            self.workspaces[batch_size] = MLPWorkspace(self.units, batch_size, self.dtype)
+        return self.workspaces[batch_size]
+
+    def predict(self, X, chunk_size=None):
         # Compute the forward pass of the network. At prediction time, there is
         # no need to save the values of hidden nodes, whereas this is required
         # at training time.
-        
-        results = []
-        for x in X:
-            
-            z1 = self.W1.dot(x.T) + self.b1
-            a1 = np.vectorize(self.relu)(z1)
+        # Rows are processed chunk_size at a time so the hidden activations
+        # never hold more than (chunk_size x hidden_size) values. The softmax
+        # is skipped since it does not change the argmax.
+        if chunk_size is None:
+            chunk_size = self.eval_chunk_size
+
+        predicted_labels = np.empty(X.shape[0], dtype=np.int64)
+        for start in range(0, X.shape[0], chunk_size):
+            X_chunk = utils.feature_rows(X, slice(start, start + chunk_size), self.dtype)
+            ws = self.workspace(X_chunk.shape[0])
+            scores = self.forward(X_chunk, ws, probabilities=False)
+            scores.argmax(axis=1, out=predicted_labels[start:start + chunk_size])
 
-            z2 = self.W2.dot(a1.T) + self.b2
-            a2 = self.softmax(z2)
-            t = np.argmax(a2)
-
-            results.append(t)
-
-        return results
+        return predicted_labels
 
-    def evaluate(self, X, y):
+    def evaluate(self, X, y, chunk_size=None):
         """
         X (n_examples x n_features)
         y (n_examples): gold labels
+        chunk_size (int): rows per forward pass, defaults to eval_chunk_size
         """
         # Identical to LinearModel.evaluate()
-        y_hat = self.predict(X)
-        # print(f"y_hat size: {len(y_hat)}")
-        # print(f"y_hat: {y_hat}")
-        # print(f"y size: {len(y)}")
-        # print(f"y: {y}")
+        y_hat = self.predict(X, chunk_size=chunk_size)
         n_correct = (y == y_hat).sum()
         n_possible = y.shape[0]
         return n_correct / n_possible
 
-    def update_parameters(self, weights, biases, grad_weights, grad_biases, eta):
-        num_layers = len(weights)
-        for i in range(num_layers):
-            weights[i] -= eta*grad_weights[i]
-            biases[i] -= eta*grad_biases[i]
-
-    def relu_derivative(self, dx):
-        def inner(out):
-            return 1 if out > 0 else 0
-        return np.vectorize(inner)(dx)
+    def update_parameters(self, learning_rate):
+        for W, b, grad_W, grad_b in zip(self.weights, self.biases,
+                                        self.grad_weights, self.grad_biases):
+            grad_W *= learning_rate
+            W -= grad_W
+            grad_b *= learning_rate
+            b -= grad_b
+
+    def softmax(self, z, ws):
+        # Row-wise softmax computed in place on z.
+        max_z = ws.row_buffer[:z.shape[0]]
+        np.max(z, axis=1, keepdims=True, out=max_z)
+        z -= max_z
+        np.exp(z, out=z)
+        np.sum(z, axis=1, keepdims=True, out=max_z)
+        z /= max_z
+
+    def forward(self, X, ws, probabilities=True):
+        """
+        X (batch_size x n_features)
+        ws: the MLPWorkspace for this batch size
 
-    def forward(self, x, weights, biases):
-        num_layers = len(weights)
-        result_a = []
+        Returns the output layer, a view into ws.activations: the softmax
+        probabilities, or the raw scores if probabilities is False.
+        """
+        num_layers = len(self.weights)
+        h = X
         for i in range(num_layers):
-            h = x if i == 0 else result_a[i-1]
-            z = weights[i].dot(h) + biases[i]
+            z = ws.activations[i]
+            np.dot(h, self.weights[i].T, out=z)
+            z += self.biases[i]
             if i < num_layers-1:  # relu for hidden layer and CE (softmax) for output layer
-                result_a.append(self.relu(z))
-            else:
-                result_a.append(self.softmax(z))
-        # For classification this is a vector of logits (label scores).
-        # For regression this is a vector of predictions.
-        return result_a[-1], result_a
-
-    def cross_entropy_derivative(self, out, target):
-        # return self.softmax(out) - target
-        t = np.zeros(out.shape)
-        t[target] = 1
-        return out - t
-
-    def backward(self, x, y, output, hiddens, weights):
-        num_layers = len(weights)
-        
-        # Grad of loss wrt last z cross entropy
-        grad_z = self.cross_entropy_derivative(output, y)
+                np.maximum(z, 0.0, out=z)
+            elif probabilities:
+                self.softmax(z, ws)
+            h = z
+        return h
 
-        grad_weights = []
-        grad_biases = []
-        for i in range(num_layers-1, -1, -1):
-            # Gradient of hidden parameters.
-            h = x if i == 0 else hiddens[i-1]
-            
-            grad_weights.append(grad_z[:, None].dot(h[:, None].T))
-            grad_biases.append(grad_z)
+    def backward(self, X, y, ws):
+        """
+        X (batch_size x n_features)
+        y (batch_size): gold labels
+        ws: the MLPWorkspace filled by forward()
 
-            # Gradient of hidden layer below.
-            grad_h = weights[i].T.dot(grad_z)
+        Writes the gradient of the loss summed over the batch into
+        self.grad_weights and self.grad_biases.
+        """
+        num_layers = len(self.weights)
+
+        # Grad of loss wrt last z cross entropy: softmax - one_hot
+        grad_z = ws.deltas[-1]
+        np.copyto(grad_z, ws.activations[-1])
+        grad_z[ws.rows, y] -= 1
 
-            # Gradient of hidden layer below before activation.
-            grad_z = grad_h * self.relu_derivative(h)   # Grad of loss wrt z3.
+        for i in range(num_layers-1, -1, -1):
+            # Gradient of hidden parameters.
+            h = X if i == 0 else ws.activations[i-1]
+            np.dot(grad_z.T, h, out=self.grad_weights[i])
+            np.sum(grad_z, axis=0, out=self.grad_biases[i])
+
+            if i > 0:
+                # Gradient of hidden layer below, before its activation.
+                grad_h = ws.deltas[i-1]
+                np.dot(grad_z, self.weights[i], out=grad_h)
+                np.greater(h, 0.0, out=ws.masks[i-1])
+                grad_h *= ws.masks[i-1]
+                grad_z = grad_h
+
+    def train_epoch(self, X: np.ndarray, y: np.ndarray, learning_rate=0.001,
+                    batch_size=1):
+        """
+        X (n_examples x n_features)
+        y (n_examples): gold labels
+        learning_rate (float): step size of a single per-example update
+        batch_size (int): see train_batches()
 
-        grad_weights.reverse()
-        grad_biases.reverse()
-        return grad_weights, grad_biases
+        Trains on the examples in the order they are in.
+        """
+        self.train_batches(utils.BatchIterator(X, y, batch_size, dtype=self.dtype),
+                           learning_rate=learning_rate)
 
+    def train_batches(self, batches, learning_rate=0.001, **kwargs):
+        """
+        batches: a utils.BatchIterator over the training set
+        learning_rate (float): step size of a single per-example update
+        other arguments are ignored
 
-    def train_epoch(self, X: np.ndarray, y: np.ndarray, learning_rate=0.001):
-        for x_i, y_i in zip(X, y):
-            output_a, results_a = self.forward(x_i, self.weights, self.biases)
-            grad_weights, grad_biases = self.backward(x_i, y_i, output_a, results_a, self.weights)
-            self.update_parameters(self.weights, self.biases, grad_weights, grad_biases, learning_rate)
+        Batches of one example give plain per-example SGD; larger batches run
+        forward/backward on whole mini-batches. The gradient is averaged over
+        the batch and the step scaled by the batch size, which amounts to
+        applying the summed gradient with learning_rate.
+        """
+        for X_batch, y_batch in batches:
+            X_batch = X_batch.astype(self.dtype, copy=False)
+            ws = self.workspace(X_batch.shape[0])
+            self.forward(X_batch, ws)
+            self.backward(X_batch, y_batch, ws)
+            self.update_parameters(learning_rate)
 
 
-def plot(epochs, valid_accs, test_accs):
+def plot(epochs, valid_accs, test_accs, title=''):
+    plt.title(title)
     plt.xlabel('Epoch')
     plt.ylabel('Accuracy')
     plt.xticks(epochs)
@@ -233,10 +590,18 @@ def plot(epochs, valid_accs, test_accs):
     plt.show()
 
 
-def main():
+def config_string(opt):
+    """The hyperparameters that identify a run, e.g. in plot or cache names."""
+    if opt.model == 'mlp':
+        return "{}-{}-{}-{}-{}".format(opt.learning_rate, opt.hidden_size, opt.layers, opt.batch_size, opt.dtype)
+    return "{}-{}-{}-{}".format(opt.learning_rate, opt.batch_size, opt.dtype, opt.workers)
+
+
+def build_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('model',
-                        choices=['perceptron', 'logistic_regression', 'mlp'],
+                        choices=['perceptron', 'averaged_perceptron',
+                                 'logistic_regression', 'mlp'],
                         help="Which model should the script run?")
     parser.add_argument('-epochs', default=20, type=int,
                         help="""Number of epochs to train for. You should not
@@ -250,44 +615,101 @@ def main():
     parser.add_argument('-learning_rate', type=float, default=0.001,
                         help="""Learning rate for parameter updates (needed for
                         logistic regression and MLP, but not perceptron)""")
-    opt = parser.parse_args()
+    parser.add_argument('-batch_size', type=int, default=1,
+                        help="""Size of the mini-batches used to train logistic
+                        regression and the MLP. 1 trains one example at a
+                        time. The perceptrons always learn from one example
+                        at a time, but gather this many at once.""")
+    parser.add_argument('-eval_chunk_size', type=int, default=1000,
+                        help="""Number of examples the MLP evaluates at once.
+                        Bounds the memory used by evaluation.""")
+    parser.add_argument('-sparse', action='store_true',
+                        help="""Store the features as CSR matrices so the
+                        linear models only touch nonzero pixels (not
+                        supported by the MLP)""")
+    parser.add_argument('-dtype', choices=['float64', 'float32'],
+                        default='float64',
+                        help="""Float precision of the data and of every model
+                        parameter""")
+    parser.add_argument('-mmap', action='store_true',
+                        help="""Memory-map the dataset from an uncompressed
+                        cache next to the .npz instead of loading it""")
+    parser.add_argument('-quantized', action='store_true',
+                        help="""Keep the images as uint8 pixels and normalize
+                        them one batch at a time (8x less memory than
+                        float64 features, not supported with -sparse)""")
+    parser.add_argument('-workers', type=int, default=1,
+                        help="""Number of processes training the perceptron or
+                        logistic regression with lock-free Hogwild! updates""")
+    return parser
+
+
+def main(argv=None, data=None):
+    """
+    argv: command line arguments, sys.argv[1:] when None
+    data: an already loaded utils.load_classification_data() dict (with the
+        bias feature for the linear models), loaded from disk when None
+
+    Returns the per-epoch validation and test accuracies.
+    """
+    parser = build_parser()
+    opt = parser.parse_args(argv)
+    if opt.sparse and opt.model == 'mlp':
+        parser.error('-sparse is only supported by the linear models')
+    if opt.sparse and opt.quantized:
+        parser.error('-sparse and -quantized cannot be combined')
+    if opt.workers > 1 and opt.model not in ('perceptron', 'logistic_regression'):
+        parser.error('-workers is only supported by the perceptron and logistic regression')
 
     utils.configure_seed(seed=42)
 
-    add_bias = opt.model != "mlp"
-    data = utils.load_classification_data(bias=add_bias)
+    if data is None:
+        add_bias = opt.model != "mlp"
+        data = utils.load_classification_data(bias=add_bias, dtype=opt.dtype,
+                                              mmap=opt.mmap, quantized=opt.quantized)
     train_X, train_y = data["train"]
     dev_X, dev_y = data["dev"]
     test_X, test_y = data["test"]
+    if opt.sparse:
+        train_X = sparse.csr_matrix(train_X)
+        dev_X = sparse.csr_matrix(dev_X)
+        test_X = sparse.csr_matrix(test_X)
 
     n_classes = np.unique(train_y).size  # 10
     n_feats = train_X.shape[1]
 
     # initialize the model
     if opt.model == 'perceptron':
-        model = Perceptron(n_classes, n_feats)
+        model = Perceptron(n_classes, n_feats, dtype=opt.dtype)
+    elif opt.model == 'averaged_perceptron':
+        model = AveragedPerceptron(n_classes, n_feats, dtype=opt.dtype)
     elif opt.model == 'logistic_regression':
-        model = LogisticRegression(n_classes, n_feats)
+        model = LogisticRegression(n_classes, n_feats, dtype=opt.dtype)
     else:
-        model = MLP(n_classes, n_feats, opt.hidden_size)
+        model = MLP(n_classes, n_feats, opt.hidden_size, layers=opt.layers,
+                    eval_chunk_size=opt.eval_chunk_size, dtype=opt.dtype)
     epochs = np.arange(1, opt.epochs + 1)
     valid_accs = []
     test_accs = []
+    # Shuffling only permutes the indices of the examples: train_X is never
+    # copied into a new order.
+    train_batches = utils.BatchIterator(train_X, train_y, opt.batch_size,
+                                        dtype=opt.dtype)
     for i in epochs:
         print('Training epoch {}'.format(i))
-        train_order = np.random.permutation(train_X.shape[0])
-        train_X = train_X[train_order]
-        train_y = train_y[train_order]
-        model.train_epoch(
-            train_X,
-            train_y,
-            learning_rate=opt.learning_rate
+        train_batches.shuffle()
+        model.train_batches(
+            train_batches,
+            learning_rate=opt.learning_rate,
+            workers=opt.workers
         )
         valid_accs.append(model.evaluate(dev_X, dev_y))
         test_accs.append(model.evaluate(test_X, test_y))
 
     # plot
-    plot(epochs, valid_accs, test_accs)
+    plot(epochs, valid_accs, test_accs, title='{}-{}'.format(opt.model, config_string(opt)))
+
+    return {"valid_accs": valid_accs, "test_accs": test_accs}
 
 
 if __name__ == '__main__':
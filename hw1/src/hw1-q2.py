@@ -3,9 +3,10 @@
 # Deep Learning Homework 1
 
 import argparse
+import sys
 
+import numpy as np
 import torch
-from torch.utils.data import DataLoader
 import torch.nn as nn
 from matplotlib import pyplot as plt
 
@@ -70,14 +71,37 @@ class FeedforwardNetwork(nn.Module):
         includes modules for several activation functions and dropout as well.
         """
         super().__init__()
-        self.dropout = nn.Dropout(dropout)
-
-        self.layer_1 = nn.Linear(n_features, hidden_size)
-        self.layer_2 = nn.Linear(hidden_size, hidden_size)
-        self.layer_3 = nn.Linear(hidden_size, hidden_size)
-        self.layer_4 = nn.Linear(hidden_size, n_classes)
+        activation = nn.ReLU if activation_type == 'relu' else nn.Tanh
+
+        # `layers` hidden layers, each followed by the activation and dropout
+        modules = []
+        in_size = n_features
+        for _ in range(layers):
+            modules += [nn.Linear(in_size, hidden_size), activation(), nn.Dropout(dropout)]
+            in_size = hidden_size
+        # The output layer gives the logits as they are
+        modules.append(nn.Linear(in_size, n_classes))
+        self.layers = nn.Sequential(*modules)
+
+    def compile_layers(self, execution):
+        """
+        execution (str): 'eager' (nothing changes), 'script' (TorchScript) or
+            'compile' (torch.compile, which generates fused CPU kernels)
 
-        self.act_func = nn.ReLU() if activation_type == 'relu' else nn.Tanh()
+        Replaces the layer stack with a compiled version of itself sharing
+        its parameters. torch.compile compiles on the first forward pass of
+        every batch shape, in train and in eval mode, which is slower.
+        """
+        if execution == 'script':
+            self.layers = torch.jit.script(self.layers)
+        elif execution == 'compile':
+            # Dropout draws from torch's generator as in eager mode, so that
+            # seeded runs give the same results in every mode. Passed as an
+            # option, the setting only applies to this model: inductor reads
+            # it when the first forward pass compiles, so patching the global
+            # config around torch.compile() would not reach it.
+            self.layers = torch.compile(self.layers, dynamic=False,
+                                        options={"fallback_random": True})
 
     def forward(self, x, **kwargs):
         """
@@ -87,33 +111,18 @@ class FeedforwardNetwork(nn.Module):
         the output logits from x. This will include using various hidden
         layers, pointwise nonlinear functions, and dropout.
         """
-
-        x = self.layer_1(x)
-        x = self.act_func(x)
-        x = self.dropout(x)
-
-        x = self.layer_2(x)
-        x = self.act_func(x)
-        x = self.dropout(x)
-
-        x = self.layer_3(x)
-        x = self.act_func(x)
-        x = self.dropout(x)
-
-        x = self.layer_4(x)
-        x = self.act_func(x)
-        x = self.dropout(x)
-        
-        return x
+        return self.layers(x)
 
 
-def train_batch(X, y, model, optimizer, criterion, **kwargs):
+def train_batch(X, y, model, optimizer, criterion, precision='fp32', **kwargs):
     """
     X (n_examples x n_features)
     y (n_examples): gold labels
     model: a PyTorch defined model
     optimizer: optimizer used in gradient step
     criterion: loss function
+    precision (str): 'fp32' or 'bf16', the autocast of the forward pass and
+        loss (see utils.autocast)
 
     To train a batch, the model needs to predict outputs for X, compute the
     loss between these predictions and the "gold" labels y using the criterion,
@@ -122,41 +131,40 @@ def train_batch(X, y, model, optimizer, criterion, **kwargs):
     Check out https://pytorch.org/docs/stable/optim.html for examples of how
     to use an optimizer object to update the parameters.
 
-    This function should return the loss (tip: call loss.item()) to get the
-    loss as a numerical value that is not part of the computation graph.
+    This function returns the loss detached from the computation graph. It
+    stays a tensor, as loss.item() would make the host wait for the step to
+    finish; utils.RunningMean sums it without syncing.
     """
     # clear the gradients
     optimizer.zero_grad()
-    # compute the model output
-    yhat = model(X)
-    # calculate loss
-    loss = criterion(yhat, y)
+    with utils.autocast(precision):
+        # compute the model output
+        yhat = model(X)
+        # calculate loss
+        loss = criterion(yhat, y)
     # credit assignment
     loss.backward()
     # update model weights
     optimizer.step()
 
-    return loss.item()
+    return loss.detach()
 
 
 def predict(model, X):
-    """X (n_examples x n_features)"""
-    scores = model(X)  # (n_examples x n_classes)
+    """X (n_examples x n_features), uint8 pixels if quantized"""
+    scores = model(utils.normalize_pixels(X))  # (n_examples x n_classes)
     predicted_labels = scores.argmax(dim=-1)  # (n_examples)
     return predicted_labels
 
 
-def evaluate(model, X, y):
+def evaluate(model, X, y, chunk_size=1000, precision='fp32'):
     """
     X (n_examples x n_features)
     y (n_examples): gold labels
+    chunk_size (int): examples per forward pass (see utils.evaluate_splits)
+    precision (str): 'fp32' or 'bf16' (see utils.autocast)
     """
-    model.eval()
-    y_hat = predict(model, X)
-    n_correct = (y == y_hat).sum().item()
-    n_possible = float(y.shape[0])
-    model.train()
-    return n_correct / n_possible
+    return utils.evaluate_splits(model, [(X, y)], chunk_size, precision)[0]
 
 
 def plot(epochs, plottable, ylabel='', name=''):
@@ -167,7 +175,35 @@ def plot(epochs, plottable, ylabel='', name=''):
     plt.savefig('%s.pdf' % (name), bbox_inches='tight')
 
 
-def main():
+def config_string(opt):
+    """The hyperparameters that identify a run, used in plot and cache names."""
+    if opt.model == "logistic_regression":
+        config = "{}-{}".format(opt.learning_rate, opt.optimizer)
+    else:
+        config = "{}-{}-{}-{}-{}-{}-{}".format(opt.learning_rate, opt.hidden_size, opt.layers, opt.dropout, opt.activation, opt.optimizer, opt.batch_size)
+    # fp32 runs keep the names they had before -precision existed
+    if opt.precision != "fp32":
+        config += "-" + opt.precision
+    return config
+
+
+def build_model(opt, n_classes, n_feats):
+    """The model chosen by the parsed command line options opt."""
+    if opt.model == 'logistic_regression':
+        return LogisticRegression(n_classes, n_feats)
+    model = FeedforwardNetwork(
+        n_classes,
+        n_feats,
+        opt.hidden_size,
+        opt.layers,
+        opt.activation,
+        opt.dropout
+    )
+    model.compile_layers(opt.execution)
+    return model
+
+
+def build_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('model',
                         choices=['logistic_regression', 'mlp'],
@@ -186,14 +222,77 @@ def main():
                         choices=['tanh', 'relu'], default='relu')
     parser.add_argument('-optimizer',
                         choices=['sgd', 'adam'], default='sgd')
-    opt = parser.parse_args()
-
-    utils.configure_seed(seed=42)
-
-    data = utils.load_classification_data()
+    parser.add_argument('-mmap', action='store_true',
+                        help="""Memory-map the dataset from an uncompressed
+                        cache next to the .npz instead of loading it""")
+    parser.add_argument('-quantized', action='store_true',
+                        help="""Keep the images as uint8 pixels and normalize
+                        them as batches are drawn (4x less memory than
+                        float32 features)""")
+    parser.add_argument('-num_workers', type=int, default=0,
+                        help="""DataLoader worker processes fetching the
+                        training batches (0 fetches them in the main one)""")
+    parser.add_argument('-eval_chunk_size', type=int, default=1000,
+                        help="""Number of examples evaluated at once. Bounds
+                        the memory used by evaluation.""")
+    parser.add_argument('-log_interval', type=int, default=0,
+                        help="""Print the running training loss every this
+                        many steps (0 only prints it after every epoch)""")
+    parser.add_argument('-precision', choices=['fp32', 'bf16'], default='fp32',
+                        help="""Run the forward passes and the loss with CPU
+                        autocast to bfloat16 (the weights stay float32)""")
+    parser.add_argument('-loader', choices=['dataloader', 'tensor'],
+                        default='dataloader',
+                        help="""How training batches are drawn: dataloader
+                        uses torch's DataLoader, tensor gathers them straight
+                        from the in-memory tensors (faster for small batches,
+                        but a different shuffling order)""")
+    parser.add_argument('-save_model', metavar='PATH',
+                        help="""Save the trained weights to PATH (e.g. for
+                        ../../quantize.py)""")
+    parser.add_argument('-execution', choices=['eager', 'script', 'compile'],
+                        default='eager',
+                        help="""How the MLP layers run: eagerly, as TorchScript
+                        or through torch.compile (torch >= 2.0; fused CPU
+                        kernels, after a slow first epoch)""")
+    parser.add_argument('-nproc', type=int, default=1,
+                        help="""Train data-parallel in this many processes
+                        (per node), each on a shard of the training set, with
+                        the -batch_size split between them""")
+    parser.add_argument('-nnodes', type=int, default=1,
+                        help="""Number of machines training together, each
+                        running the same command with its -node_rank""")
+    parser.add_argument('-node_rank', type=int, default=0)
+    parser.add_argument('-master_addr', default='127.0.0.1',
+                        help="Address of node 0")
+    parser.add_argument('-master_port', type=int, default=29500)
+    return parser
+
+
+def run(rank, world_size, opt, data, argv, results=None):
+    """
+    Trains and evaluates the model of the parsed command line options opt
+    as process rank of world_size (see main()). Only rank 0 evaluates,
+    prints, plots and saves; it returns main()'s results, or puts them in
+    the results queue if there is one.
+    """
+    # With several processes, DistributedDataParallel copies the initial
+    # weights of rank 0 to the others; the seeds differ for the dropout masks
+    utils.configure_seed(seed=42 + rank)
+    log = print if rank == 0 else lambda *args: None
+
+    if data is None:
+        data = utils.load_classification_data(dtype=np.float32, mmap=opt.mmap,
+                                              quantized=opt.quantized)
     dataset = utils.ClassificationDataset(data)
-    train_dataloader = DataLoader(
-        dataset, batch_size=opt.batch_size, shuffle=True)
+    if opt.loader == 'tensor':
+        train_dataloader = utils.TensorBatchIterator(
+            dataset.X, dataset.y, opt.batch_size, shuffle=True)
+    else:
+        # -batch_size is the batch of all the processes together
+        train_dataloader = utils.batch_loader(
+            dataset, opt.batch_size // world_size, shuffle=True,
+            num_workers=opt.num_workers, rank=rank, world_size=world_size)
 
     dev_X, dev_y = dataset.dev_X, dataset.dev_y
     test_X, test_y = dataset.test_X, dataset.test_y
@@ -202,17 +301,11 @@ def main():
     n_feats = dataset.X.shape[1]
 
     # initialize the model
-    if opt.model == 'logistic_regression':
-        model = LogisticRegression(n_classes, n_feats)
-    else:
-        model = FeedforwardNetwork(
-            n_classes,
-            n_feats,
-            opt.hidden_size,
-            opt.layers,
-            opt.activation,
-            opt.dropout
-        )
+    model = build_model(opt, n_classes, n_feats)
+    # the training steps all-reduce the gradients of the processes
+    train_model = model
+    if world_size > 1:
+        train_model = nn.parallel.DistributedDataParallel(model)
 
     # get an optimizer
     optims = {"adam": torch.optim.Adam, "sgd": torch.optim.SGD}
@@ -230,31 +323,97 @@ def main():
     epochs = torch.arange(1, opt.epochs + 1)
     train_mean_losses = []
     valid_accs = []
-    train_losses = []
+    train_loss = utils.RunningMean()
     for ii in epochs:
-        print('Training epoch {}'.format(ii))
-        for X_batch, y_batch in train_dataloader:
+        log('Training epoch {}'.format(ii))
+        train_loss.reset()
+        if world_size > 1:
+            utils.set_epoch(train_dataloader, int(ii))
+        for step, (X_batch, y_batch) in enumerate(train_dataloader, 1):
             loss = train_batch(
-                X_batch, y_batch, model, optimizer, criterion)
-            train_losses.append(loss)
+                X_batch, y_batch, train_model, optimizer, criterion, opt.precision)
+            train_loss.add(loss, X_batch.shape[0])
+            if opt.log_interval and step % opt.log_interval == 0:
+                log('Step {}: training loss {:.4f}'.format(step, train_loss.mean()))
 
-        mean_loss = torch.tensor(train_losses).mean().item()
-        print('Training loss: %.4f' % (mean_loss))
+        if world_size > 1:
+            train_loss.all_reduce()
+        mean_loss = train_loss.mean()
+        log('Training loss: %.4f' % (mean_loss))
 
         train_mean_losses.append(mean_loss)
-        valid_accs.append(evaluate(model, dev_X, dev_y))
+        if rank > 0:
+            continue
+        if ii < opt.epochs:
+            valid_acc = evaluate(model, dev_X, dev_y, opt.eval_chunk_size,
+                                 opt.precision)
+        else:
+            # The last epoch evaluates dev and test in the same pass
+            valid_acc, test_acc = utils.evaluate_splits(
+                model, [(dev_X, dev_y), (test_X, test_y)], opt.eval_chunk_size,
+                opt.precision)
+        valid_accs.append(valid_acc)
         print('Valid acc: %.4f' % (valid_accs[-1]))
 
-    print('Final Test acc: %.4f' % (evaluate(model, test_X, test_y)))
+    if rank > 0:
+        return None
+
+    if opt.epochs == 0:
+        # no last epoch evaluated the test set
+        test_acc = evaluate(model, test_X, test_y, opt.eval_chunk_size,
+                            opt.precision)
+    print('Final Test acc: %.4f' % (test_acc))
+    if opt.save_model:
+        utils.save_model(model, opt.save_model, argv)
     # plot
-    if opt.model == "logistic_regression":
-        config = "{}-{}".format(opt.learning_rate, opt.optimizer)
-    else:
-        config = "{}-{}-{}-{}-{}-{}-{}".format(opt.learning_rate, opt.hidden_size, opt.layers, opt.dropout, opt.activation, opt.optimizer, opt.batch_size)
+    config = config_string(opt)
 
     plot(epochs, train_mean_losses, ylabel='Loss', name='{}-training-loss-{}'.format(opt.model, config))
     plot(epochs, valid_accs, ylabel='Accuracy', name='{}-validation-accuracy-{}'.format(opt.model, config))
 
+    result = {"train_losses": train_mean_losses, "valid_accs": valid_accs,
+              "test_acc": test_acc}
+    if results is not None:
+        results.put(result)
+    return result
+
+
+def main(argv=None, data=None):
+    """
+    argv: command line arguments, sys.argv[1:] when None
+    data: an already loaded utils.load_classification_data() dict, loaded
+        from disk when None
+
+    Returns the per-epoch training losses and validation accuracies and the
+    final test accuracy. With -nproc or -nnodes, training runs data-parallel
+    in -nproc processes per node (see utils.launch()), and only node 0
+    returns them.
+    """
+    parser = build_parser()
+    opt = parser.parse_args(argv)
+    if argv is None:
+        argv = sys.argv[1:]
+    if opt.num_workers > 0 and opt.loader == 'tensor':
+        parser.error('-num_workers only applies to -loader dataloader')
+    if opt.execution != 'eager' and opt.model != 'mlp':
+        parser.error('-execution only applies to the mlp')
+    if opt.execution == 'compile' and not hasattr(torch, 'compile'):
+        parser.error('-execution compile needs torch >= 2.0 (torch {} is '
+                     'installed)'.format(torch.__version__))
+    world_size = opt.nproc * opt.nnodes
+    if world_size > 1 and opt.loader == 'tensor':
+        parser.error('-nproc and -nnodes need -loader dataloader')
+    if opt.batch_size % world_size:
+        parser.error('-batch_size must be a multiple of -nproc times -nnodes')
+
+    if world_size == 1:
+        return run(0, 1, opt, data, argv)
+
+    results = torch.multiprocessing.get_context('spawn').SimpleQueue()
+    utils.launch(run, (opt, data, argv, results), opt.nproc, opt.nnodes,
+                 opt.node_rank, opt.master_addr, opt.master_port)
+    return results.get() if opt.node_rank == 0 else None
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+# Deep Learning Homework 1
+#
+# Microbenchmarks of the hw1-q1.py models: training and inference
+# throughput (examples per second) of every model for several batch sizes,
+# hidden sizes and dtypes, measured on seeded synthetic data shaped like
+# Kuzushiji-MNIST. Results are saved as JSON; passing a previous results file
+# with -compare flags every measurement that got slower than -threshold.
+#
+# Example:
+#   python kernel_benchmark.py -output before.json
+#   (change the code)
+#   python kernel_benchmark.py -output after.json -compare before.json
+
+import argparse
+import importlib
+import json
+import platform
+import sys
+
+import numpy as np
+
+import utils
+
+hw1_q1 = importlib.import_module("hw1-q1")
+
+N_FEATURES = 784
+N_CLASSES = 10
+
+
+def synthetic_data(n_examples, dtype):
+    """
+    The n_examples training features (as dtype) and labels of
+    utils.synthetic_classification_data().
+    """
+    data = utils.synthetic_classification_data(
+        dtype=dtype, n_train=n_examples, n_dev=1, n_test=1,
+        n_features=N_FEATURES, n_classes=N_CLASSES)
+    return data["train"]
+
+
+def build_model(name, n_features, hidden_size, dtype):
+    if name == 'perceptron':
+        return hw1_q1.Perceptron(N_CLASSES, n_features, dtype=dtype)
+    if name == 'averaged_perceptron':
+        return hw1_q1.AveragedPerceptron(N_CLASSES, n_features, dtype=dtype)
+    if name == 'logistic_regression':
+        return hw1_q1.LogisticRegression(N_CLASSES, n_features, dtype=dtype)
+    return hw1_q1.MLP(N_CLASSES, n_features, hidden_size, dtype=dtype)
+
+
+def benchmark(opt):
+    """Returns {name: examples per second} for every configuration."""
+    results = {}
+    for dtype in opt.dtypes:
+        X, y = synthetic_data(opt.n_train, dtype)
+        X_bias = np.hstack((X, np.ones((X.shape[0], 1), dtype=dtype)))
+        for model_name in opt.models:
+            is_mlp = model_name == 'mlp'
+            hidden_sizes = opt.hidden_sizes if is_mlp else [0]
+            train_X = X if is_mlp else X_bias
+            for hidden_size in hidden_sizes:
+                utils.configure_seed(seed=42)
+                model = build_model(model_name, train_X.shape[1], hidden_size, dtype)
+                tag = model_name if not is_mlp else "mlp-h{}".format(hidden_size)
+                for batch_size in opt.batch_sizes:
+                    batches = utils.BatchIterator(train_X, y, batch_size)
+                    seconds = utils.best_time(
+                        lambda: model.train_batches(batches, learning_rate=opt.learning_rate),
+                        opt.repeats)
+                    name = "{}/train/bs{}/{}".format(tag, batch_size, dtype)
+                    results[name] = opt.n_train / seconds
+                    print("{:<45} {:>12.0f} examples/s".format(name, results[name]))
+
+                seconds = utils.best_time(lambda: model.predict(train_X), opt.repeats)
+                name = "{}/predict/{}".format(tag, dtype)
+                results[name] = opt.n_train / seconds
+                print("{:<45} {:>12.0f} examples/s".format(name, results[name]))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints the speed ratio of every measurement present in both runs and
+    returns the names of the ones that are more than threshold slower.
+    """
+    regressions = []
+    print("\n{:<45} {:>10}".format("benchmark", "new / old"))
+    for name in sorted(set(results) & set(baseline)):
+        ratio = results[name] / baseline[name]
+        flag = ""
+        if ratio < 1 - threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print("{:<45} {:>9.2f}x{}".format(name, ratio, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-models', nargs='+',
+                        choices=['perceptron', 'averaged_perceptron',
+                                 'logistic_regression', 'mlp'],
+                        default=['perceptron', 'averaged_perceptron',
+                                 'logistic_regression', 'mlp'])
+    parser.add_argument('-batch_sizes', type=int, nargs='+', default=[1, 32, 256])
+    parser.add_argument('-hidden_sizes', type=int, nargs='+', default=[100, 200],
+                        help="Hidden sizes of the MLP benchmarks.")
+    parser.add_argument('-dtypes', nargs='+', choices=['float64', 'float32'],
+                        default=['float64', 'float32'])
+    parser.add_argument('-n_train', type=int, default=10000,
+                        help="Number of synthetic examples per measurement.")
+    parser.add_argument('-learning_rate', type=float, default=0.001)
+    parser.add_argument('-repeats', type=int, default=3,
+                        help="Each measurement keeps the fastest of this many runs.")
+    parser.add_argument('-output', default='kernel_benchmark.json',
+                        help="Where the results are saved.")
+    parser.add_argument('-compare',
+                        help="Results of a previous run to compare against.")
+    parser.add_argument('-threshold', type=float, default=0.1,
+                        help="""Relative slowdown over which a benchmark is
+                        flagged as a regression.""")
+    opt = parser.parse_args()
+
+    results = benchmark(opt)
+    with open(opt.output, 'w') as f:
+        json.dump({
+            "meta": {
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "machine": platform.machine(),
+                "n_train": opt.n_train,
+                "repeats": opt.repeats,
+            },
+            "results": results,
+        }, f, indent=2)
+
+    if opt.compare:
+        with open(opt.compare) as f:
+            baseline = json.load(f)["results"]
+        if compare(results, baseline, opt.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
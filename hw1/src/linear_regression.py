@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+# Deep Learning Homework 1
+#
+# Fits the hw1-q1.py LinearRegression model to the Ames housing data
+# (ames.npz), either exactly with a single streamed pass and a Cholesky
+# solve or with SGD, and prints the time it took to reach each test error
+# so that both solvers can be compared.
+#
+# Example:
+#   python linear_regression.py cholesky -l2_penalty 1
+#   python linear_regression.py sgd -epochs 20 -batch_size 32
+
+import argparse
+import importlib
+import time
+
+import utils
+
+hw1_q1 = importlib.import_module("hw1-q1")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('solver', choices=['cholesky', 'sgd'],
+                        help="""cholesky solves the normal equations exactly,
+                        sgd runs -epochs of stochastic gradient descent""")
+    parser.add_argument('-l2_penalty', type=float, default=0,
+                        help="Ridge regularization of the cholesky solver")
+    parser.add_argument('-chunk_size', type=int, default=10000,
+                        help="""Examples read at once by the cholesky
+                        solver""")
+    parser.add_argument('-epochs', type=int, default=20)
+    parser.add_argument('-learning_rate', type=float, default=0.001)
+    parser.add_argument('-batch_size', type=int, default=1,
+                        help="Size of the mini-batches used by sgd")
+    parser.add_argument('-dtype', choices=['float64', 'float32'],
+                        default='float64')
+    parser.add_argument('-mmap', action='store_true',
+                        help="""Memory-map the dataset from an uncompressed
+                        cache next to the .npz instead of loading it""")
+    return parser
+
+
+def main(argv=None):
+    """
+    argv: command line arguments, sys.argv[1:] when None
+
+    Returns the seconds elapsed and the train and test RMSE after the solve
+    (cholesky) or after every epoch (sgd).
+    """
+    opt = build_parser().parse_args(argv)
+
+    utils.configure_seed(seed=42)
+
+    data = utils.load_regression_data(bias=True, dtype=opt.dtype, mmap=opt.mmap)
+    train_X, train_y = data["train"]
+    test_X, test_y = data["test"]
+
+    model = hw1_q1.LinearRegression(train_X.shape[1], dtype=opt.dtype)
+    seconds, train_rmses, test_rmses = [], [], []
+
+    def log(name, elapsed):
+        seconds.append(elapsed)
+        train_rmses.append(model.evaluate(train_X, train_y))
+        test_rmses.append(model.evaluate(test_X, test_y))
+        print('{:<10} {:>9.3f}s  train RMSE {:.4f}  test RMSE {:.4f}'.format(
+            name, elapsed, train_rmses[-1], test_rmses[-1]))
+
+    if opt.solver == 'cholesky':
+        start = time.perf_counter()
+        model.fit(utils.BatchIterator(train_X, train_y, opt.chunk_size,
+                                      dtype=opt.dtype),
+                  l2_penalty=opt.l2_penalty)
+        log('cholesky', time.perf_counter() - start)
+    else:
+        train_batches = utils.BatchIterator(train_X, train_y, opt.batch_size,
+                                            dtype=opt.dtype)
+        # Only training time is counted, not the evaluations
+        elapsed = 0.0
+        for i in range(1, opt.epochs + 1):
+            start = time.perf_counter()
+            train_batches.shuffle()
+            model.train_batches(train_batches, learning_rate=opt.learning_rate)
+            elapsed += time.perf_counter() - start
+            log('epoch {}'.format(i), elapsed)
+
+    return {"seconds": seconds, "train_rmses": train_rmses, "test_rmses": test_rmses}
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+# Deep Learning Homework 1
+#
+# Epoch throughput (examples per second) of the ways hw1-q2.py and hw2-q2.py
+# can draw training batches: the per-example DataLoader they used to build,
+# utils.batch_loader() (-loader dataloader) and utils.TensorBatchIterator
+# (-loader tensor). Each is timed iterating over the batches alone and
+# running a training epoch of a hw1-q2.py model, on seeded synthetic data
+# shaped like Kuzushiji-MNIST.
+#
+# Example:
+#   python loader_benchmark.py -batch_sizes 1 16 128 -model mlp
+
+import argparse
+import importlib
+
+import numpy as np
+import torch
+from torch import nn
+
+import utils
+
+hw1_q2 = importlib.import_module("hw1-q2")
+
+N_FEATURES = 784
+N_CLASSES = 10
+
+
+def synthetic_data(n_examples):
+    """
+    utils.synthetic_classification_data() with n_examples float32 training
+    examples (and a token dev and test set).
+    """
+    return utils.synthetic_classification_data(
+        dtype=np.float32, n_train=n_examples, n_dev=1, n_test=1,
+        n_features=N_FEATURES, n_classes=N_CLASSES)
+
+
+def build_loader(name, dataset, batch_size):
+    if name == 'dataloader':
+        return torch.utils.data.DataLoader(dataset, batch_size=batch_size, shuffle=True)
+    if name == 'batch_loader':
+        return utils.batch_loader(dataset, batch_size, shuffle=True)
+    return utils.TensorBatchIterator(dataset.X, dataset.y, batch_size, shuffle=True)
+
+
+def epoch_seconds(loader, repeats, step=None):
+    """
+    Seconds of the fastest of `repeats` passes over loader, calling
+    step(X, y) on every batch.
+    """
+    def epoch():
+        for X_batch, y_batch in loader:
+            if step is not None:
+                step(X_batch, y_batch)
+    return utils.best_time(epoch, repeats)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-loaders', nargs='+',
+                        choices=['dataloader', 'batch_loader', 'tensor'],
+                        default=['dataloader', 'batch_loader', 'tensor'])
+    parser.add_argument('-batch_sizes', type=int, nargs='+', default=[1, 16, 128])
+    parser.add_argument('-model', choices=['logistic_regression', 'mlp'],
+                        default='logistic_regression',
+                        help="The hw1-q2.py model trained in the epochs timed")
+    parser.add_argument('-n_train', type=int, default=20000,
+                        help="Number of synthetic examples per epoch.")
+    parser.add_argument('-repeats', type=int, default=3,
+                        help="Each measurement keeps the fastest of this many epochs.")
+    parser.add_argument('-threads', type=int, default=1,
+                        help="torch threads (1 makes per-batch overhead stand out)")
+    opt = parser.parse_args()
+
+    torch.set_num_threads(opt.threads)
+    utils.configure_seed(seed=42)
+    dataset = utils.ClassificationDataset(synthetic_data(opt.n_train))
+
+    print('{:<14} {:>6} {:>16} {:>16} {:>9}'.format(
+        'loader', 'batch', 'iterate (ex/s)', 'train (ex/s)', 'speedup'))
+    for batch_size in opt.batch_sizes:
+        baseline = None
+        for name in opt.loaders:
+            if opt.model == 'logistic_regression':
+                model = hw1_q2.LogisticRegression(N_CLASSES, N_FEATURES)
+            else:
+                model = hw1_q2.FeedforwardNetwork(
+                    N_CLASSES, N_FEATURES, 100, 1, 'relu', 0.3)
+            optimizer = torch.optim.SGD(model.parameters(), lr=0.01)
+            criterion = nn.CrossEntropyLoss()
+
+            def step(X_batch, y_batch):
+                hw1_q2.train_batch(X_batch, y_batch, model, optimizer, criterion)
+
+            loader = build_loader(name, dataset, batch_size)
+            iterate = opt.n_train / epoch_seconds(loader, opt.repeats)
+            train = opt.n_train / epoch_seconds(loader, opt.repeats, step)
+            if baseline is None:
+                baseline = train
+            print('{:<14} {:>6} {:>16.0f} {:>16.0f} {:>8.2f}x'.format(
+                name, batch_size, iterate, train, train / baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,9 @@
+import collections
+import concurrent.futures
+import itertools
 import os
 import random
+import warnings
 
 import numpy as np
 import torch
@@ -19,10 +23,13 @@ def configure_seed(seed):
         torch.backends.cudnn.benchmark = False
 
 
-def fetch_classification_data(dataset="Fashion-MNIST", random_state=42):
+def fetch_classification_data(dataset="Fashion-MNIST", random_state=42,
+                              quantized=False):
     """
     Loads the dataset from openml, normalizes feature values (by dividing
-    everything by 256), and saves to an npz file.
+    everything by 256), and saves to an npz file. With quantized the pixels
+    are instead saved as uint8 in [0, 255] and only normalized when loaded
+    (see load_classification_data()).
 
     dataset: the name of the dataset (accepted: "mnist_784", "Fashion-MNIST")
     """
@@ -30,7 +37,10 @@ def fetch_classification_data(dataset="Fashion-MNIST", random_state=42):
     start_time = time.time()
     X, y = fetch_openml(dataset, version=1, return_X_y=True, as_frame=False)
     print("Downloaded data in {:.4f} seconds".format(time.time() - start_time))
-    X /= 256  # normalize
+    if quantized:
+        X = X.astype(np.uint8)
+    else:
+        X /= 256  # normalize
     y = y.astype(int)  # fetch_openml loads it as a str
     train_dev_X, train_dev_y = X[:60000], y[:60000]
     train_X, dev_X, train_y, dev_y = train_test_split(
@@ -44,22 +54,140 @@ def fetch_classification_data(dataset="Fashion-MNIST", random_state=42):
         Xtest=test_X, ytest=test_y
     )
 
-def read_raw_sign_mnist(path):
-    with open(path) as f:
-        f.readline()
-        data = np.array(
-            [[float(tok) for tok in line.strip().split(',')] for line in f]
-        )
-    X = data[:, 1:]
-    X /= 256  # normalize
+def synthetic_classification_arrays(n_train=50000, n_dev=10000, n_test=10000,
+                                    n_features=784, n_classes=10, noise=0.3,
+                                    random_state=42):
+    """
+    A seeded synthetic dataset laid out like the archives of
+    fetch_classification_data(quantized=True): a dict of uint8 pixels
+    Xtrain, Xdev and Xtest and labels ytrain, ydev and ytest.
+
+    Every class has a random prototype image with about 60% of its pixels
+    zero, like the MNIST variants, and its examples are copies of it with a
+    fraction noise of their pixels replaced by random ones, so there is
+    something to learn.
+    """
+    rng = np.random.RandomState(random_state)
+    prototypes = rng.randint(0, 256, size=(n_classes, n_features))
+    prototypes *= rng.rand(n_classes, n_features) < 0.4
+    prototypes = prototypes.astype(np.uint8)
+    arrays = {}
+    for split, n_examples in (("train", n_train), ("dev", n_dev), ("test", n_test)):
+        X = np.empty((n_examples, n_features), dtype=np.uint8)
+        y = rng.randint(0, n_classes, size=n_examples)
+        # Generated 10000 rows at a time to bound the temporary arrays
+        for start in range(0, n_examples, 10000):
+            X_chunk = X[start:start + 10000]
+            X_chunk[...] = prototypes[y[start:start + 10000]]
+            replaced = rng.rand(*X_chunk.shape) < noise
+            n_replaced = replaced.sum()
+            X_chunk[replaced] = rng.randint(0, 256, size=n_replaced) * (rng.rand(n_replaced) < 0.4)
+        arrays["X" + split] = X
+        arrays["y" + split] = y
+    return arrays
+
+
+def make_classification_data(path="Kuzushiji-MNIST.npz", compressed=False,
+                             **kwargs):
+    """
+    Writes synthetic_classification_arrays(**kwargs) to path, so that the
+    entry points can run without network access and at other scales.
+    """
+    arrays = synthetic_classification_arrays(**kwargs)
+    (np.savez_compressed if compressed else np.savez)(path, **arrays)
+
+
+def synthetic_classification_data(bias=False, dtype=np.float64,
+                                  quantized=False, **kwargs):
+    """
+    synthetic_classification_arrays(**kwargs) in memory, as the dict
+    load_classification_data() returns (e.g. for benchmarks).
+    """
+    return classification_splits(synthetic_classification_arrays(**kwargs),
+                                 bias, dtype, quantized)
+
+
+def make_regression_data(path="ames.npz", n_train=2344, n_test=586,
+                         n_features=80, noise=0.1, random_state=42):
+    """
+    Writes a seeded synthetic regression problem to path in the layout
+    load_regression_data() reads: standard normal features and targets that
+    are a random linear function of them plus gaussian noise of standard
+    deviation noise.
+    """
+    rng = np.random.RandomState(random_state)
+    w = rng.randn(n_features)
+    b = rng.randn()
+    arrays = {}
+    for split, n_examples in (("train", n_train), ("test", n_test)):
+        X = rng.randn(n_examples, n_features)
+        y = X.dot(w) + b + noise * rng.randn(n_examples)
+        arrays["X" + split] = X
+        arrays["y" + split] = y.reshape(-1, 1)
+    np.savez(path, **arrays)
+
+
+def parse_csv_chunk(chunk, n_columns):
+    """
+    chunk (bytes): whole lines of comma-separated integers in [0, 255]
+
+    Returns them as a (n_lines x n_columns) uint8 array, parsed in C.
+    """
+    text = chunk.replace(b"\r", b"").strip().replace(b"\n", b",")
+    return np.fromstring(text, dtype=np.uint8, sep=",").reshape(-1, n_columns)
+
+
+def read_raw_sign_mnist(path, chunk_lines=4096, workers=1):
+    """
+    Reads a Sign-MNIST csv (label followed by the pixels on every line)
+    straight into a preallocated uint8 array, chunk_lines lines at a time,
+    so memory stays bounded by the size of the final arrays. With workers > 1
+    the chunks are parsed by that many processes, at most 2 * workers chunks
+    being in flight at once.
+    """
+    with open(path, "rb") as f:
+        n_columns = f.readline().count(b",") + 1
+        n_rows = sum(1 for line in f if line.strip())
+    data = np.empty((n_rows, n_columns), dtype=np.uint8)
+
+    def chunks():
+        with open(path, "rb") as f:
+            f.readline()
+            while True:
+                lines = [line for line in itertools.islice(f, chunk_lines) if line.strip()]
+                if not lines:
+                    return
+                yield b"".join(lines)
+
+    row = 0
+    if workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            pending = collections.deque()
+            for chunk in chunks():
+                pending.append(executor.submit(parse_csv_chunk, chunk, n_columns))
+                if len(pending) >= 2 * workers:
+                    parsed = pending.popleft().result()
+                    data[row:row + parsed.shape[0]] = parsed
+                    row += parsed.shape[0]
+            while pending:
+                parsed = pending.popleft().result()
+                data[row:row + parsed.shape[0]] = parsed
+                row += parsed.shape[0]
+    else:
+        for chunk in chunks():
+            parsed = parse_csv_chunk(chunk, n_columns)
+            data[row:row + parsed.shape[0]] = parsed
+            row += parsed.shape[0]
+
+    X = np.multiply(data[:, 1:], 1 / 256)  # normalize
     y = data[:, 0].astype(int)
     y[y > 9] -= 1  # missing class 9 (i.e. j)
     return X, y
 
 
-def build_sign_mnist_data(train_path, test_path, random_state=42):
-    train_dev_X, train_dev_y = read_raw_sign_mnist(train_path)
-    test_X, test_y = read_raw_sign_mnist(test_path)
+def build_sign_mnist_data(train_path, test_path, random_state=42, workers=1):
+    train_dev_X, train_dev_y = read_raw_sign_mnist(train_path, workers=workers)
+    test_X, test_y = read_raw_sign_mnist(test_path, workers=workers)
 
     train_X, dev_X, train_y, dev_y = train_test_split(
         train_dev_X, train_dev_y, train_size=20000, test_size=7455, random_state=random_state
@@ -72,62 +200,519 @@ def build_sign_mnist_data(train_path, test_path, random_state=42):
     )
 
 
-def load_classification_data(path='Kuzushiji-MNIST.npz', bias=False):
+def quantize(X):
+    """Normalized features (pixels / 256) back to uint8 pixels in [0, 255]."""
+    return np.rint(X * 256).astype(np.uint8)
+
+
+def dequantize(pixels, dtype=np.float64, out=None):
+    """
+    pixels (n_examples x n_pixels): uint8 pixels in [0, 255]
+
+    Returns the normalized features (pixels / 256) as dtype, written into
+    out if given.
+    """
+    if out is None:
+        out = np.empty(pixels.shape, dtype=dtype)
+    return np.multiply(pixels, 1 / 256, out=out)
+
+
+def convert_features(X, dtype=np.float64, quantized=False):
+    """
+    X: features as saved in an npz archive, either normalized floats or
+        uint8 pixels (see fetch_classification_data())
+
+    Returns uint8 pixels if quantized, normalized dtype features otherwise.
+    """
+    if quantized:
+        return X if X.dtype == np.uint8 else quantize(X)
+    if X.dtype == np.uint8:
+        return dequantize(X, dtype)
+    return X.astype(dtype, copy=False)
+
+
+class QuantizedFeatures(object):
+
+    def __init__(self, pixels, bias=False):
+        """
+        pixels (n_examples x n_pixels): uint8 pixels in [0, 255]
+        bias (bool): whether a constant 1 feature follows the pixels
+
+        Stands in for the (n_examples x n_features) normalized feature matrix
+        while keeping one byte per pixel in memory: the features of a group
+        of rows are only computed when they are read with rows(), so a batch
+        or an evaluation chunk is the largest float copy ever made.
+        """
+        self.pixels = pixels
+        self.bias = bias
+        self.shape = (pixels.shape[0], pixels.shape[1] + int(bias))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def rows(self, idx, dtype=np.float64, out=None):
+        """
+        idx: an array of row indices or a slice
+
+        Returns the normalized features of those rows as dtype, written into
+        out if given.
+        """
+        if isinstance(idx, slice):
+            pixels = self.pixels[idx]
+        else:
+            pixels = np.take(self.pixels, idx, axis=0)
+        if out is None:
+            out = np.empty((pixels.shape[0], self.shape[1]), dtype=dtype)
+        dequantize(pixels, out=out[:, :pixels.shape[1]])
+        if self.bias:
+            out[:, -1] = 1
+        return out
+
+
+def feature_rows(X, idx, dtype):
+    """The rows idx of X (an array or QuantizedFeatures) as dtype features."""
+    if isinstance(X, QuantizedFeatures):
+        return X.rows(idx, dtype)
+    return X[idx].astype(dtype, copy=False)
+
+
+def cached_array(path, key, dtype=None, bias=False, quantized=False):
+    """
+    Memory-maps (read-only) the array `key` of the npz archive at path from
+    an uncompressed .npy copy kept in a cache directory next to it. The copy
+    is written the first time, or when the archive is newer, already
+    converted to dtype (or to uint8 pixels if quantized, see
+    convert_features()) and with the bias column, so that loading it later
+    neither decompresses nor copies anything and processes on the same host
+    share the same page cache.
+    """
+    name = key
+    if quantized:
+        name += "-uint8"
+    elif dtype is not None:
+        name += "-" + np.dtype(dtype).name
+    if bias:
+        name += "-bias"
+    cache_dir = os.path.splitext(path)[0] + "_cache"
+    cache_path = os.path.join(cache_dir, name + ".npy")
+    if not os.path.exists(cache_path) or os.path.getmtime(cache_path) < os.path.getmtime(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        with np.load(path) as data:
+            array = data[key]
+        if dtype is not None or quantized:
+            array = convert_features(array, dtype, quantized)
+        if bias:
+            array = np.hstack((array, np.ones((array.shape[0], 1), dtype=array.dtype)))
+        # Written under a temporary name first so that concurrent processes
+        # never map a half-written file.
+        tmp_path = os.path.join(cache_dir, "{}.{}.tmp.npy".format(name, os.getpid()))
+        np.save(tmp_path, array)
+        os.replace(tmp_path, cache_path)
+    return np.load(cache_path, mmap_mode='r')
+
+
+def load_classification_data(path='Kuzushiji-MNIST.npz', bias=False,
+                             dtype=np.float64, mmap=False, quantized=False):
     """
     Loads the preprocessed, featurized fashion-mnist dataset from
-    Fashion-MNIST.npz, optionally adding a bias feature.
+    Fashion-MNIST.npz, optionally adding a bias feature. The features are
+    returned as dtype (e.g. np.float32 to halve memory traffic). With mmap
+    the arrays are read-only memory maps of an uncompressed cache (see
+    cached_array()) instead of arrays in memory. With quantized the
+    features are QuantizedFeatures, uint8 pixels that are only normalized
+    a batch at a time, and dtype is left to whoever reads them.
     """
     assert path in {"sign_mnist.npz", 'Fashion-MNIST.npz', 'Kuzushiji-MNIST.npz'}
-    data = np.load(path)
-    train_X = data["Xtrain"]
-    dev_X = data["Xdev"]
-    test_X = data["Xtest"]
-    if bias:
-        train_X = np.hstack((train_X, np.ones((train_X.shape[0], 1))))
-        dev_X = np.hstack((dev_X, np.ones((dev_X.shape[0], 1))))
-        test_X = np.hstack((test_X, np.ones((test_X.shape[0], 1))))
+    if mmap and quantized:
+        # The bias column is added when rows are read, as it is not a pixel
+        return {split: (QuantizedFeatures(cached_array(path, "X" + split, quantized=True), bias),
+                        cached_array(path, "y" + split))
+                for split in ("train", "dev", "test")}
+    if mmap:
+        return {split: (cached_array(path, "X" + split, dtype=dtype, bias=bias),
+                        cached_array(path, "y" + split))
+                for split in ("train", "dev", "test")}
+    return classification_splits(np.load(path), bias, dtype, quantized)
+
+
+def classification_splits(data, bias=False, dtype=np.float64, quantized=False):
+    """
+    data: a mapping with the arrays of an npz archive (Xtrain, ytrain,
+        Xdev, ydev, Xtest, ytest)
+
+    Returns the dict of load_classification_data(), the features converted
+    as it describes.
+    """
+    train_X = convert_features(data["Xtrain"], dtype, quantized)
+    dev_X = convert_features(data["Xdev"], dtype, quantized)
+    test_X = convert_features(data["Xtest"], dtype, quantized)
+    if quantized:
+        train_X = QuantizedFeatures(train_X, bias)
+        dev_X = QuantizedFeatures(dev_X, bias)
+        test_X = QuantizedFeatures(test_X, bias)
+    elif bias:
+        train_X = np.hstack((train_X, np.ones((train_X.shape[0], 1), dtype=dtype)))
+        dev_X = np.hstack((dev_X, np.ones((dev_X.shape[0], 1), dtype=dtype)))
+        test_X = np.hstack((test_X, np.ones((test_X.shape[0], 1), dtype=dtype)))
     return {"train": (train_X, data["ytrain"]),
             "dev": (dev_X, data["ydev"]),
             "test": (test_X, data["ytest"])}
 
 
-def load_regression_data(bias=False):
+def load_regression_data(bias=False, dtype=np.float64, mmap=False):
     """
     Loads the preprocessed, featurized Ames housing dataset from ames.npz.
+    With mmap the arrays are read-only memory maps of an uncompressed cache
+    (see cached_array()).
     """
+    if mmap:
+        return {split: (cached_array('ames.npz', "X" + split, dtype=dtype, bias=bias),
+                        cached_array('ames.npz', "y" + split, dtype=dtype).reshape(-1))
+                for split in ("train", "test")}
     data = np.load('ames.npz')
-    train_X = data["Xtrain"]
-    test_X = data["Xtest"]
-    train_y = data["ytrain"].reshape(-1)
-    test_y = data["ytest"].reshape(-1)
+    train_X = data["Xtrain"].astype(dtype, copy=False)
+    test_X = data["Xtest"].astype(dtype, copy=False)
+    train_y = data["ytrain"].reshape(-1).astype(dtype, copy=False)
+    test_y = data["ytest"].reshape(-1).astype(dtype, copy=False)
     if bias:
-        train_X = np.hstack((train_X, np.ones((train_X.shape[0], 1))))
-        test_X = np.hstack((test_X, np.ones((test_X.shape[0], 1))))
+        train_X = np.hstack((train_X, np.ones((train_X.shape[0], 1), dtype=dtype)))
+        test_X = np.hstack((test_X, np.ones((test_X.shape[0], 1), dtype=dtype)))
     return {"train": (train_X, train_y),
             "test": (test_X, test_y)}
 
 
+class BatchIterator(object):
+
+    def __init__(self, X, y, batch_size=1, order=None, dtype=np.float64):
+        """
+        X (n_examples x n_features): a numpy array, a scipy sparse matrix or
+            QuantizedFeatures
+        y (n_examples): gold labels
+        batch_size (int): examples per batch (the last one may be smaller)
+        order (n_examples): the row indices to visit, all of them by default
+        dtype: what QuantizedFeatures are normalized to (other X are yielded
+            with their own dtype)
+
+        Iterates over the mini-batches of X and y in the order of a
+        permutation of row indices. X itself is never reordered: each batch
+        is gathered into a buffer that is reused from batch to batch, so
+        the arrays yielded are only valid until the next one.
+        """
+        self.X = X
+        self.y = y
+        self.batch_size = batch_size
+        self.order = np.arange(y.shape[0]) if order is None else order
+        self.dtype = dtype
+        self.X_buffer = None
+        self.y_buffer = None
+
+    def shuffle(self):
+        """Randomly permutes the order in which the examples are visited."""
+        self.order = self.order[np.random.permutation(self.order.shape[0])]
+
+    def shards(self, n):
+        """Splits the examples into n iterators over disjoint parts of order."""
+        return [BatchIterator(self.X, self.y, self.batch_size, order, self.dtype)
+                for order in np.array_split(self.order, n)]
+
+    def __len__(self):
+        return -(-self.order.shape[0] // self.batch_size)
+
+    def __iter__(self):
+        quantized = isinstance(self.X, QuantizedFeatures)
+        dense = quantized or isinstance(self.X, np.ndarray)
+        if dense and self.X_buffer is None:
+            dtype = self.dtype if quantized else self.X.dtype
+            self.X_buffer = np.empty((self.batch_size,) + self.X.shape[1:], dtype=dtype)
+            self.y_buffer = np.empty(self.batch_size, dtype=self.y.dtype)
+        for start in range(0, self.order.shape[0], self.batch_size):
+            idx = self.order[start:start + self.batch_size]
+            n = idx.shape[0]
+            if quantized:
+                self.X.rows(idx, out=self.X_buffer[:n])
+                np.take(self.y, idx, out=self.y_buffer[:n])
+                yield self.X_buffer[:n], self.y_buffer[:n]
+            elif dense:
+                np.take(self.X, idx, axis=0, out=self.X_buffer[:n])
+                np.take(self.y, idx, out=self.y_buffer[:n])
+                yield self.X_buffer[:n], self.y_buffer[:n]
+            else:
+                yield self.X[idx], self.y[idx]
+
+
+def normalize_pixels(X):
+    """
+    Normalized float32 features of a uint8 tensor of pixels (see
+    QuantizedFeatures); float tensors are returned as they are.
+    """
+    if X.dtype == torch.uint8:
+        return X.to(torch.float32).mul_(1 / 256)
+    return X
+
+
+def as_tensor(array, dtype):
+    """
+    Wraps a numpy array as a tensor without copying it (unless it is not of
+    dtype, a numpy dtype, yet).
+    """
+    array = np.ascontiguousarray(array, dtype=dtype)
+    with warnings.catch_warnings():
+        # Memory maps and shared-memory views are read-only; the tensors
+        # over them are never written to.
+        warnings.filterwarnings("ignore", message="The given NumPy array is not writable")
+        return torch.from_numpy(array)
+
+
+def feature_tensor(X):
+    """Features as kept by ClassificationDataset: uint8 if quantized."""
+    if isinstance(X, QuantizedFeatures):
+        return as_tensor(X.pixels, np.uint8)
+    return as_tensor(X, np.float32)
+
+
+class RunningMean(object):
+
+    def __init__(self):
+        """
+        Running mean of a per-step metric such as the training loss, in O(1)
+        memory and time per step. The sum stays a tensor on the device of
+        the values added, so add() never waits for them to be computed (as
+        calling .item() on every step would): the host only syncs when
+        mean() is read, e.g. at logging intervals and at the end of an epoch.
+        """
+        self.reset()
+
+    def reset(self):
+        self.total = None
+        self.count = 0
+
+    def add(self, value, count=1):
+        """
+        value: a scalar tensor, the mean of the metric over count items
+        count: an int or a scalar tensor (e.g. the number of non-padding
+            tokens)
+        """
+        value = value.detach().to(torch.float64) * count
+        self.total = value if self.total is None else self.total.add_(value)
+        self.count += count
+
+    def mean(self):
+        return float(self.total / self.count)
+
+    def all_reduce(self):
+        """
+        Sums the metric over the processes of the torch.distributed group,
+        so that mean() is that of every item they added. All of them must
+        call it, after adding at least one value.
+        """
+        stats = torch.stack([self.total, torch.as_tensor(self.count, dtype=torch.float64)])
+        torch.distributed.all_reduce(stats)
+        self.total, self.count = stats[0], stats[1]
+
+
+def best_time(fn, repeats):
+    """The fastest of `repeats` runs of fn(), in seconds."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def autocast(precision):
+    """
+    precision (str): 'fp32', or 'bf16' to run the forward passes and losses
+        in the block with CPU autocast to bfloat16
+
+    Autocast runs matmuls and convolutions in bfloat16 and keeps precision
+    sensitive ops (e.g. softmax, losses) in float32; the parameters, their
+    gradients and the optimizer state stay float32.
+    """
+    return torch.autocast("cpu", dtype=torch.bfloat16, enabled=precision == 'bf16')
+
+
+def evaluate_splits(model, splits, chunk_size=1000, precision='fp32'):
+    """
+    model: an nn.Module mapping a batch of examples to class scores
+    splits: a list of (X, y) tensor pairs, e.g. [(dev_X, dev_y), (test_X,
+        test_y)], X being uint8 pixels if quantized
+    chunk_size (int): examples per forward pass
+    precision (str): 'fp32' or 'bf16' (see autocast())
+
+    Returns the accuracy of the model on each split, all evaluated in a
+    single pass in eval mode. It runs under torch.no_grad, so no autograd
+    graph is built (not inference_mode: a TorchScript model caches tensors
+    across calls, and inference tensors would then break its next training
+    step), and chunk_size examples at a time, so memory
+    does not grow with the size of the splits: only a running count of
+    correct predictions is kept, and read once per split.
+    """
+    was_training = model.training
+    model.eval()
+    accuracies = []
+    with torch.no_grad(), autocast(precision):
+        for X, y in splits:
+            n_correct = torch.zeros((), dtype=torch.long)
+            for start in range(0, X.shape[0], chunk_size):
+                scores = model(normalize_pixels(X[start:start + chunk_size]))
+                n_correct += (scores.argmax(dim=-1) == y[start:start + chunk_size]).sum()
+            accuracies.append(n_correct.item() / y.shape[0])
+    model.train(was_training)
+    return accuracies
+
+
+def save_model(model, path, argv):
+    """
+    Saves the weights of a trained model along with the command line
+    arguments that built it, so that it can be rebuilt later (see
+    ../../quantize.py).
+    """
+    # torch.compile keeps the compiled module under _orig_mod
+    state_dict = {k.replace('_orig_mod.', ''): v
+                  for k, v in model.state_dict().items()}
+    torch.save({'argv': list(argv), 'state_dict': state_dict}, path)
+
+
 class ClassificationDataset(torch.utils.data.Dataset):
 
     def __init__(self, data):
         """
         data: the dict returned by utils.load_classification_data
+
+        The tensors share memory with the arrays of data, which are only
+        copied if they are not float32 features and int64 labels already.
+        Quantized features stay uint8 tensors (a quarter of float32) and
+        the examples are normalized as they are read, so the features of
+        dev_X and test_X must go through normalize_pixels() before use.
         """
         train_X, train_y = data["train"]
         dev_X, dev_y = data["dev"]
         test_X, test_y = data["test"]
 
-        self.X = torch.tensor(train_X, dtype=torch.float32)
-        self.y = torch.tensor(train_y, dtype=torch.long)
+        self.X = feature_tensor(train_X)
+        self.y = as_tensor(train_y, np.int64)
 
-        self.dev_X = torch.tensor(dev_X, dtype=torch.float32)
-        self.dev_y = torch.tensor(dev_y, dtype=torch.long)
+        self.dev_X = feature_tensor(dev_X)
+        self.dev_y = as_tensor(dev_y, np.int64)
 
-        self.test_X = torch.tensor(test_X, dtype=torch.float32)
-        self.test_y = torch.tensor(test_y, dtype=torch.long)
+        self.test_X = feature_tensor(test_X)
+        self.test_y = as_tensor(test_y, np.int64)
 
     def __len__(self):
         return len(self.X)
 
     def __getitem__(self, idx):
-        return self.X[idx], self.y[idx]
+        """idx: one example index, or a list of them to fetch a whole batch"""
+        return normalize_pixels(self.X[idx]), self.y[idx]
+
+    def share_memory(self):
+        """
+        Moves the training tensors to shared memory (a single copy), so
+        that DataLoader workers use them instead of pickling their own.
+        """
+        self.X.share_memory_()
+        self.y.share_memory_()
+        return self
+
+
+class TensorBatchIterator(object):
+
+    def __init__(self, X, y, batch_size=1, shuffle=True):
+        """
+        X (n_examples x n_features): a tensor, uint8 pixels if quantized
+        y (n_examples): gold labels
+        batch_size (int): examples per batch (the last one may be smaller)
+        shuffle (bool): visit the examples in a new random order every epoch
+
+        Iterates over the mini-batches of tensors that are already in memory,
+        gathering each with the slice of a permuted index tensor (or taking a
+        plain slice without shuffle). Unlike a DataLoader no sampler, fetcher
+        or collate runs per batch, which is what dominates small batches.
+        The permutation comes from torch's global generator.
+        """
+        self.X = X
+        self.y = y
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+
+    def __len__(self):
+        return -(-self.X.shape[0] // self.batch_size)
+
+    def __iter__(self):
+        n_examples = self.X.shape[0]
+        order = torch.randperm(n_examples) if self.shuffle else None
+        for start in range(0, n_examples, self.batch_size):
+            if order is None:
+                idx = slice(start, start + self.batch_size)
+            else:
+                idx = order[start:start + self.batch_size]
+            yield normalize_pixels(self.X[idx]), self.y[idx]
+
+
+def batch_loader(dataset, batch_size, shuffle=True, num_workers=0, rank=0,
+                 world_size=1):
+    """
+    A DataLoader over a ClassificationDataset that yields the same batches
+    as DataLoader(dataset, batch_size, shuffle=shuffle), but fetches each
+    with a single dataset[indices] gather instead of batch_size
+    __getitem__ calls followed by a collate.
+
+    With world_size > 1, process rank of a torch.distributed group only
+    iterates over its 1/world_size shard of the dataset (a
+    DistributedSampler); call set_epoch() before every epoch to reshuffle
+    the shards.
+    """
+    if world_size > 1:
+        sampler = torch.utils.data.distributed.DistributedSampler(
+            dataset, num_replicas=world_size, rank=rank, shuffle=shuffle)
+    elif shuffle:
+        sampler = torch.utils.data.RandomSampler(dataset)
+    else:
+        sampler = torch.utils.data.SequentialSampler(dataset)
+    if num_workers > 0:
+        dataset.share_memory()
+    return torch.utils.data.DataLoader(
+        dataset,
+        sampler=torch.utils.data.BatchSampler(sampler, batch_size, drop_last=False),
+        batch_size=None,  # the sampler already yields batches
+        num_workers=num_workers,
+    )
+
+
+def set_epoch(loader, epoch):
+    """Shuffles the shards of a distributed batch_loader() for epoch."""
+    sampler = loader.sampler.sampler
+    if isinstance(sampler, torch.utils.data.distributed.DistributedSampler):
+        sampler.set_epoch(epoch)
+
+
+def distributed_worker(local_rank, fn, args, nproc, nnodes, node_rank,
+                       master_addr, master_port, threads):
+    """The entry point of every process started by launch()."""
+    torch.set_num_threads(threads)
+    rank = node_rank * nproc + local_rank
+    world_size = nnodes * nproc
+    torch.distributed.init_process_group(
+        "gloo", init_method="tcp://{}:{}".format(master_addr, master_port),
+        rank=rank, world_size=world_size)
+    try:
+        fn(rank, world_size, *args)
+    finally:
+        torch.distributed.destroy_process_group()
+
+
+def launch(fn, args, nproc, nnodes=1, node_rank=0, master_addr="127.0.0.1",
+           master_port=29500):
+    """
+    Runs fn(rank, world_size, *args) in nproc new processes and waits for
+    them. They join a gloo process group of nnodes * nproc processes, which
+    spans several machines when the same command is started on each of
+    them with its own node_rank (0 to nnodes - 1), master_addr being the
+    address of node 0. The torch threads of this process are split between
+    the nproc processes.
+    """
+    threads = max(1, torch.get_num_threads() // nproc)
+    torch.multiprocessing.spawn(
+        distributed_worker, nprocs=nproc,
+        args=(fn, args, nproc, nnodes, node_rank, master_addr, master_port, threads))
@@ -1,5 +1,6 @@
 import argparse
 import random
+import sys
 from functools import partial
 
 import numpy as np
@@ -11,6 +12,7 @@ from torch.utils.data import DataLoader
 import matplotlib.pyplot as plt
 
 from data import collate_samples, MTDataset, PAD_IDX, SOS_IDX, EOS_IDX
+from metrics import RunningMean
 from models import Encoder, Decoder, Seq2Seq, Attention, reshape_state
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -25,6 +27,14 @@ def configure_seed(seed):
         torch.backends.cudnn.deterministic = True
 
 
+def autocast(precision):
+    """
+    precision: "fp32", or "bf16" to autocast the forward passes and losses
+    in the block to bfloat16 (the parameters stay float32)
+    """
+    return torch.autocast(device.type, dtype=torch.bfloat16, enabled=precision == "bf16")
+
+
 def distance(str1, str2):
     """Simple Levenshtein implementation for evalm."""
     m = np.zeros([len(str2) + 1, len(str1) + 1], dtype=int)
@@ -44,7 +54,7 @@ def distance(str1, str2):
     return m[len(str2), len(str1)]
 
 
-def train(data, model, lr, n_epochs, padding_idx):
+def train(data, model, lr, n_epochs, padding_idx, log_interval=0, precision="fp32"):
 
     train_iter, val_iter, test_iter = data
 
@@ -55,46 +65,57 @@ def train(data, model, lr, n_epochs, padding_idx):
     optimizer = torch.optim.Adam(model.parameters(), lr=lr)
 
     val_err_rates = []
+    train_losses = []
+    # Per-token mean of the loss over the epoch, synced only when printed
+    train_loss = RunningMean()
 
     # Training the Model
     for epoch in range(n_epochs):
 
-        for src, tgt in train_iter:
+        train_loss.reset()
+        for step, (src, tgt) in enumerate(train_iter, 1):
             src_lengths = (src != PAD_IDX).sum(1)
             src, tgt = src.to(device), tgt.to(device)
             src_lengths = src_lengths.to(device)
 
             optimizer.zero_grad()
-            outputs, _ = model(src, src_lengths, tgt)
-            # print(outputs.shape)
-            # print(tgt.shape)
-            # o = outputs.reshape(-1, outputs.shape[-1])
-            # t = tgt[:, 1:].reshape(-1)
-            # print(o.shape)
-            # print(t.shape)
-            loss = criterion(outputs.reshape(-1, outputs.shape[-1]), tgt[:, 1:].reshape(-1))
+            with autocast(precision):
+                outputs, _ = model(src, src_lengths, tgt)
+                # print(outputs.shape)
+                # print(tgt.shape)
+                # o = outputs.reshape(-1, outputs.shape[-1])
+                # t = tgt[:, 1:].reshape(-1)
+                # print(o.shape)
+                # print(t.shape)
+                loss = criterion(outputs.reshape(-1, outputs.shape[-1]), tgt[:, 1:].reshape(-1))
             loss.backward()
             optimizer.step()
+            train_loss.add(loss, (tgt[:, 1:] != padding_idx).sum())
+            if log_interval and step % log_interval == 0:
+                print("Step %d, Loss: %.4f" % (step, train_loss.mean()))
 
-        print("Epoch: [%d/%d], Loss: %.4f" % (epoch + 1, n_epochs, loss))
+        train_losses.append(train_loss.mean())
+        print("Epoch: [%d/%d], Loss: %.4f" % (epoch + 1, n_epochs, train_losses[-1]))
 
-        val_err_rate = test(model, val_iter, "val")
+        val_err_rate = test(model, val_iter, "val", precision=precision)
 
         val_err_rates.append(val_err_rate)
 
-    test_err_rate = test(model, test_iter, "test", examples_idx=[42, 233, 512])
+    test_err_rate = test(
+        model, test_iter, "test", examples_idx=[42, 233, 512], precision=precision
+    )
 
-    return (val_err_rates, test_err_rate)
+    return (train_losses, val_err_rates, test_err_rate)
 
 
-def test(model, data_iter, data_type, examples_idx=None):
+def test(model, data_iter, data_type, examples_idx=None, precision="fp32"):
     # Test the Model
     model.eval()
     error_rates = []
     true_strs = []
     pred_strs = []
 
-    with torch.no_grad():
+    with torch.no_grad(), autocast(precision):
         for jj, (src, tgt) in enumerate(data_iter):
             src_lengths = (src != PAD_IDX).sum(1)
             src, tgt = src.to(device), tgt.to(device)
@@ -170,23 +191,21 @@ def test(model, data_iter, data_type, examples_idx=None):
     return mean_error_rate
 
 
-def main():
-    parser = argparse.ArgumentParser(description="")
-    parser.add_argument("--lr", type=float, default=0.003)
-    parser.add_argument("--dropout", type=float, default=0.3)
-    parser.add_argument("--n_epochs", type=int, default=50)
-    parser.add_argument("--batch_size", type=int, default=64)
-    parser.add_argument("--hidden_size", type=int, default=128)
-    parser.add_argument("--seed", type=int, default=42)
-    parser.add_argument(
-        "--use_attn", action="store_const", const=True, default=False
-    )
+def config_string(opt):
+    """The hyperparameters that identify a run, used in plot and cache names."""
+    config = "attn_{}-{}-{}-{}-{}-{}".format(opt.use_attn, opt.lr, opt.dropout, opt.batch_size, opt.hidden_size, opt.seed)
+    # fp32 runs keep the names they had before --precision existed
+    if opt.precision != "fp32":
+        config += "-" + opt.precision
+    return config
 
-    opt = parser.parse_args()
 
-    configure_seed(opt.seed)
-
-    print("Loading data...")
+def load_data(batch_size):
+    """
+    Returns the (train, val, test) DataLoaders, evaluation ones yielding one
+    example at a time as test() expects, and the source and target
+    vocabulary sizes.
+    """
     train_dataset = MTDataset("train")
     dev_dataset = MTDataset(
         "val",
@@ -203,24 +222,25 @@ def main():
 
     train_iter = DataLoader(
         train_dataset,
-        batch_size=opt.batch_size,
+        batch_size=batch_size,
         shuffle=True,
         collate_fn=collate_fn,
     )
     val_iter = DataLoader(dev_dataset, batch_size=1, shuffle=False)
     test_iter = DataLoader(test_dataset, batch_size=1, shuffle=False)
 
-    data_iters = (train_iter, val_iter, test_iter)
-
     src_vocab_size = train_dataset.input_lang.n_words
     tgt_vocab_size = train_dataset.output_lang.n_words
 
-    padding_idx = PAD_IDX
+    return (train_iter, val_iter, test_iter), src_vocab_size, tgt_vocab_size
+
 
+def build_model(opt, src_vocab_size, tgt_vocab_size):
+    """The Seq2Seq chosen by the parsed command line options opt."""
     encoder = Encoder(
         src_vocab_size,
         opt.hidden_size,
-        padding_idx,
+        PAD_IDX,
         opt.dropout,
     )
 
@@ -233,24 +253,74 @@ def main():
         opt.hidden_size,
         tgt_vocab_size,
         attn,
-        padding_idx,
+        PAD_IDX,
         opt.dropout,
     )
 
-    model = Seq2Seq(encoder, decoder).to(device)
+    return Seq2Seq(encoder, decoder).to(device)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="")
+    parser.add_argument("--lr", type=float, default=0.003)
+    parser.add_argument("--dropout", type=float, default=0.3)
+    parser.add_argument("--n_epochs", type=int, default=50)
+    parser.add_argument("--batch_size", type=int, default=64)
+    parser.add_argument("--hidden_size", type=int, default=128)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--use_attn", action="store_const", const=True, default=False
+    )
+    parser.add_argument(
+        "--log_interval", type=int, default=0,
+        help="print the running loss every this many steps (0: every epoch)"
+    )
+    parser.add_argument(
+        "--precision", choices=["fp32", "bf16"], default="fp32",
+        help="autocast the forward passes and losses to bfloat16"
+    )
+    parser.add_argument(
+        "--save_model", metavar="PATH",
+        help="save the trained weights to PATH (e.g. for ../../quantize.py)"
+    )
+    return parser
+
+
+def main(argv=None):
+    """
+    argv: command line arguments, sys.argv[1:] when None
+
+    Returns the per-epoch training losses and validation error rates and the
+    test error rate.
+    """
+    opt = build_parser().parse_args(argv)
+
+    configure_seed(opt.seed)
+
+    print("Loading data...")
+    data_iters, src_vocab_size, tgt_vocab_size = load_data(opt.batch_size)
+
+    padding_idx = PAD_IDX
+
+    model = build_model(opt, src_vocab_size, tgt_vocab_size)
     model.train()
 
     print("Training...")
-    val_acc, test_acc = train(
+    train_losses, val_acc, test_acc = train(
         data_iters,
         model,
         opt.lr,
         opt.n_epochs,
         padding_idx,
+        opt.log_interval,
+        opt.precision,
     )
 
     print("Final validation error rate: %.4f" % (val_acc[-1]))
     print("Test error rate: %.4f" % (test_acc))
+    if opt.save_model:
+        torch.save({"argv": list(sys.argv[1:] if argv is None else argv),
+                    "state_dict": model.state_dict()}, opt.save_model)
 
     plt.plot(np.arange(1, opt.n_epochs + 1), val_acc, label="Validation Set")
 
@@ -260,10 +330,13 @@ def main():
     plt.ylabel("Error Rate")
     plt.legend()
     plt.savefig(
-        "attn_%s_err_rate.pdf" % (str(opt.use_attn),),
+        "%s_err_rate.pdf" % (config_string(opt),),
         bbox_inches="tight",
     )
 
+    return {"train_losses": train_losses, "val_err_rates": val_acc,
+            "test_err_rate": test_acc}
+
 
 if __name__ == "__main__":
     main()
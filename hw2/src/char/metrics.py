@@ -0,0 +1,31 @@
+import torch
+
+
+class RunningMean(object):
+
+    def __init__(self):
+        """
+        Running mean of a per-step metric such as the training loss, in O(1)
+        memory and time per step. The sum stays a tensor on the device of
+        the values added, so add() never waits for them to be computed (as
+        calling .item() on every step would): the host only syncs when
+        mean() is read, e.g. at logging intervals and at the end of an epoch.
+        """
+        self.reset()
+
+    def reset(self):
+        self.total = None
+        self.count = 0
+
+    def add(self, value, count=1):
+        """
+        value: a scalar tensor, the mean of the metric over count items
+        count: an int or a scalar tensor (e.g. the number of non-padding
+            tokens)
+        """
+        value = value.detach().to(torch.float64) * count
+        self.total = value if self.total is None else self.total.add_(value)
+        self.count += count
+
+    def mean(self):
+        return float(self.total / self.count)
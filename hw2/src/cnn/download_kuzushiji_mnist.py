@@ -1,6 +1,12 @@
 #!/usr/bin/env python
 
+import argparse
+
 import utils
 
 if __name__ == "__main__":
-    utils.fetch_classification_data("Kuzushiji-MNIST")
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-quantized', action='store_true',
+                        help="Save the pixels as uint8 instead of normalized floats")
+    opt = parser.parse_args()
+    utils.fetch_classification_data("Kuzushiji-MNIST", quantized=opt.quantized)
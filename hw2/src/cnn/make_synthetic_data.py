@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+# Writes seeded synthetic datasets where the entry points look for the real
+# ones, to run them offline or to benchmark them at other scales.
+#
+# Example (10x the examples of Kuzushiji-MNIST):
+#   python make_synthetic_data.py classification -scale 10
+#   python hw1-q1.py mlp -quantized -mmap
+
+import argparse
+import os
+
+import utils
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('task', choices=['classification', 'regression'],
+                        help="""classification writes a dataset for
+                        load_classification_data(), regression one for
+                        load_regression_data()""")
+    parser.add_argument('-output',
+                        choices=['Kuzushiji-MNIST.npz', 'Fashion-MNIST.npz',
+                                 'sign_mnist.npz', 'ames.npz'],
+                        help="""Defaults to Kuzushiji-MNIST.npz or ames.npz,
+                        the files the entry points load""")
+    parser.add_argument('-scale', type=float, default=1,
+                        help="""Multiplies the default number of examples of
+                        every split (50000/10000/10000 for classification,
+                        2344/586 for regression)""")
+    parser.add_argument('-n_train', type=int)
+    parser.add_argument('-n_dev', type=int)
+    parser.add_argument('-n_test', type=int)
+    parser.add_argument('-n_features', type=int,
+                        help="""784 (28x28 images, which the CNN needs) for
+                        classification, 80 for regression by default""")
+    parser.add_argument('-n_classes', type=int, default=10)
+    parser.add_argument('-noise', type=float,
+                        help="""Fraction of randomized pixels (0.3 by default)
+                        or standard deviation of the target noise (0.1)""")
+    parser.add_argument('-seed', type=int, default=42)
+    parser.add_argument('-compressed', action='store_true',
+                        help="""Compress the classification archive (much
+                        slower to write and to load)""")
+    parser.add_argument('-force', action='store_true',
+                        help="Overwrite the output if it exists")
+    opt = parser.parse_args()
+
+    if opt.task == 'classification':
+        defaults = {"n_train": 50000, "n_dev": 10000, "n_test": 10000,
+                    "n_features": 784, "noise": 0.3,
+                    "output": "Kuzushiji-MNIST.npz"}
+        if opt.output == 'ames.npz':
+            parser.error('ames.npz is read by load_regression_data()')
+    else:
+        defaults = {"n_train": 2344, "n_test": 586, "n_features": 80,
+                    "noise": 0.1, "output": "ames.npz"}
+        if opt.output not in (None, 'ames.npz'):
+            parser.error('regression data can only be written to ames.npz')
+    for key, value in defaults.items():
+        if getattr(opt, key) is None:
+            if key.startswith("n_") and key != "n_features":
+                value = int(value * opt.scale)
+            setattr(opt, key, value)
+
+    if os.path.exists(opt.output) and not opt.force:
+        parser.error('{} exists, pass -force to overwrite it'.format(opt.output))
+
+    if opt.task == 'classification':
+        utils.make_classification_data(
+            opt.output, n_train=opt.n_train, n_dev=opt.n_dev,
+            n_test=opt.n_test, n_features=opt.n_features,
+            n_classes=opt.n_classes, noise=opt.noise,
+            random_state=opt.seed, compressed=opt.compressed)
+    else:
+        utils.make_regression_data(
+            opt.output, n_train=opt.n_train, n_test=opt.n_test,
+            n_features=opt.n_features, noise=opt.noise,
+            random_state=opt.seed)
+    print("Wrote {}".format(opt.output))
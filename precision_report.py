@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+# bfloat16 report for the torch entry points
+#
+# Trains the FeedforwardNetwork of hw1-q2.py, the CNN of hw2-q2.py and the
+# Seq2Seq of hw2-q3.py with -precision fp32 and bf16, one run at a time in a
+# fresh process (see sweep.run_trial), and prints the wall time and the
+# validation and test scores of each run along with the bf16 speedup and
+# score change.
+#
+# Example:
+#   python precision_report.py -entries hw1-q2 hw2-q2 -epochs 5
+
+import argparse
+import multiprocessing
+import os
+
+import sweep
+
+# entry -> (the config trained, metric name, validation and test metric of a
+# main() result)
+RUNS = {
+    "hw1-q2": ({"model": "mlp", "batch_size": 64}, "accuracy",
+               lambda r: r["valid_accs"][-1], lambda r: r["test_acc"]),
+    "hw2-q2": ({}, "accuracy",
+               lambda r: r["valid_accs"][-1], lambda r: r["test_acc"]),
+    "hw2-q3": ({"use_attn": True}, "error rate",
+               lambda r: r["val_err_rates"][-1], lambda r: r["test_err_rate"]),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-entries', nargs='+', choices=sorted(RUNS),
+                        default=sorted(RUNS))
+    parser.add_argument('-epochs', type=int, default=2,
+                        help="Epochs of every run.")
+    parser.add_argument('-threads', type=int, default=os.cpu_count(),
+                        help="Number of threads every run may use.")
+    opt = parser.parse_args()
+
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(opt.threads)
+    os.environ["MPLBACKEND"] = "Agg"
+
+    tasks = []
+    for name in opt.entries:
+        entry = sweep.ENTRIES[name]
+        config = dict(RUNS[name][0])
+        config[entry.epochs] = opt.epochs
+        for precision in ("fp32", "bf16"):
+            config["precision"] = precision
+            tasks.append((name, sweep.to_argv(entry, config), None))
+
+    # One run at a time, so that the timings do not compete for the CPU
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1, initializer=sweep.init_worker, initargs=(opt.threads,),
+                  maxtasksperchild=1) as pool:
+        results = pool.map(sweep.run_trial, tasks)
+
+    print('{:<8} {:<6} {:<11} {:>9} {:>8} {:>8} {:>9} {:>10}'.format(
+        'entry', 'prec', 'metric', 'time (s)', 'valid', 'test', 'speedup', 'test diff'))
+    for i in range(0, len(tasks), 2):
+        name = tasks[i][0]
+        _, metric, valid, test = RUNS[name]
+        fp32, bf16 = results[i], results[i + 1]
+        for precision, result in (("fp32", fp32), ("bf16", bf16)):
+            print('{:<8} {:<6} {:<11} {:>9.1f} {:>8.4f} {:>8.4f} {:>8.2f}x {:>+10.4f}'.format(
+                name, precision, metric, result["seconds"], valid(result),
+                test(result), fp32["seconds"] / result["seconds"],
+                test(result) - test(fp32)))
+
+
+if __name__ == '__main__':
+    main()
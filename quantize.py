@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+# Post-training int8 quantization of the torch models
+#
+# Loads a model saved with -save_model by hw1-q2.py (LogisticRegression or
+# FeedforwardNetwork) or hw2-q2.py (CNN), or with --save_model by hw2-q3.py
+# (Seq2Seq), and converts it to int8 for CPU inference:
+#   - Linear and LSTM layers use dynamic quantization: int8 weights, with
+#     the activations quantized on the fly at every call;
+#   - the CNN uses static quantization: its activation ranges are calibrated
+#     on the first -calibration_size training examples, so the whole network
+#     runs in int8 between the input and the log-softmax.
+# Prints the serialized size, the CPU latency and the validation and test
+# scores of the fp32 and int8 models, the scores coming from the scripts'
+# own evaluate() (hw1-q2.py, hw2-q2.py) and test() (hw2-q3.py). -output
+# saves the int8 model, which loads back with
+# torch.load(path, weights_only=False) from the script's directory.
+#
+# Example:
+#   (cd hw2/src/cnn && python hw2-q2.py -epochs 5 -save_model cnn.pt)
+#   python quantize.py hw2-q2 hw2/src/cnn/cnn.pt -output cnn-int8.pt
+
+import argparse
+import copy
+import io
+import os
+import time
+
+import numpy as np
+import torch
+from torch import nn
+from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+import sweep
+
+# entry -> name of its validation and test metric
+METRICS = {
+    "hw1-q2": "accuracy",
+    "hw2-q2": "accuracy",
+    "hw2-q3": "error rate",
+}
+
+
+def serialized_size(model):
+    """Bytes taken by the saved state_dict of model."""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes
+
+
+def quantize_static(model, calibration, example):
+    """
+    model: a CNN in eval mode
+    calibration: batches of normalized examples the activation ranges are
+        observed on
+    example: a batch of one example, used to trace the model
+    """
+    qconfig_mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+    prepared = prepare_fx(copy.deepcopy(model), qconfig_mapping,
+                          example_inputs=(example,))
+    # Quantized convolutions return channels-last tensors, which view()
+    # cannot flatten
+    for node in prepared.graph.nodes:
+        if node.op == "call_method" and node.target == "view":
+            node.target = "reshape"
+    prepared.recompile()
+    with torch.inference_mode():
+        for X in calibration:
+            prepared(X)
+    return convert_fx(prepared)
+
+
+class Classifier(object):
+    """A hw1-q2.py or hw2-q2.py model with the data it was trained on."""
+
+    def __init__(self, name, module, opt, state_dict):
+        self.module = module
+        self.utils = module.utils
+        self.opt = opt
+        data = self.utils.load_classification_data(
+            dtype=np.float32, mmap=opt.mmap, quantized=opt.quantized)
+        self.dataset = self.utils.ClassificationDataset(data)
+        if name == "hw2-q2":
+            self.model = module.CNN(opt.dropout)
+        else:
+            # quantization works on the plain modules
+            opt.execution = "eager"
+            n_classes = torch.unique(self.dataset.y).shape[0]
+            self.model = module.build_model(opt, n_classes, self.dataset.X.shape[1])
+        self.model.load_state_dict(state_dict)
+        self.model.eval()
+        self.static = name == "hw2-q2"
+
+    def quantize(self, calibration_size):
+        if not self.static:
+            return quantize_dynamic(self.model, {nn.Linear}, dtype=torch.qint8)
+        X = self.dataset.X
+        calibration = [
+            self.utils.normalize_pixels(X[start:start + self.opt.eval_chunk_size])
+            for start in range(0, min(calibration_size, X.shape[0]),
+                               self.opt.eval_chunk_size)]
+        return quantize_static(self.model, calibration, calibration[0][:1])
+
+    def scores(self, model):
+        """Validation and test accuracy (see evaluate())."""
+        # The CNN applies dropout in eval mode too: seed it alike for both models
+        self.utils.configure_seed(seed=42)
+        dataset = self.dataset
+        return [self.module.evaluate(model, X, y, self.opt.eval_chunk_size)
+                for X, y in ((dataset.dev_X, dataset.dev_y),
+                             (dataset.test_X, dataset.test_y))]
+
+    def latency(self, model, n_batches, batch_size):
+        """
+        Mean seconds to classify a batch of batch_size validation examples,
+        over n_batches batches.
+        """
+        X = self.dataset.dev_X
+        batches = [self.utils.normalize_pixels(X[start:start + batch_size])
+                   for start in range(0, X.shape[0], batch_size)][:n_batches]
+        with torch.inference_mode():
+            start = time.perf_counter()
+            for X_batch in batches:
+                model(X_batch)
+            return (time.perf_counter() - start) / len(batches)
+
+
+class Translator(object):
+    """A hw2-q3.py Seq2Seq with the data it was trained on."""
+
+    def __init__(self, module, opt, state_dict):
+        self.module = module
+        self.opt = opt
+        data_iters, src_vocab_size, tgt_vocab_size = module.load_data(opt.batch_size)
+        _, self.val_iter, self.test_iter = data_iters
+        self.model = module.build_model(opt, src_vocab_size, tgt_vocab_size)
+        self.model.load_state_dict(state_dict)
+        self.model.eval()
+        self.val_seconds = {}
+
+    def quantize(self, calibration_size):
+        return quantize_dynamic(self.model, {nn.Linear, nn.LSTM}, dtype=torch.qint8)
+
+    def scores(self, model):
+        """Validation and test error rates (see test()), timing the former."""
+        start = time.perf_counter()
+        val_err_rate = self.module.test(model, self.val_iter, "val")
+        self.val_seconds[id(model)] = time.perf_counter() - start
+        return [val_err_rate, self.module.test(model, self.test_iter, "test")]
+
+    def latency(self, model, n_batches, batch_size):
+        """
+        Mean seconds to translate one validation example, from the greedy
+        decoding of scores(), which goes one example at a time (so the
+        arguments are ignored).
+        """
+        return self.val_seconds[id(model)] / len(self.val_iter.dataset)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('entry', choices=sorted(METRICS))
+    parser.add_argument('checkpoint',
+                        help="A model saved with the entry's -save_model flag")
+    parser.add_argument('-output', metavar='PATH',
+                        help="Save the int8 model to PATH")
+    parser.add_argument('-calibration_size', type=int, default=1000,
+                        help="""Number of training examples the activation
+                        ranges of the CNN are calibrated on""")
+    parser.add_argument('-batch_size', type=int, default=1,
+                        help="""Examples per call in the latency of the
+                        classifiers (hw2-q3.py translates one at a time)""")
+    parser.add_argument('-latency_batches', type=int, default=500,
+                        help="""Number of validation batches the latency of
+                        the classifiers is averaged over""")
+    parser.add_argument('-threads', type=int, default=torch.get_num_threads())
+    opt = parser.parse_args()
+
+    torch.set_num_threads(opt.threads)
+    checkpoint = torch.load(opt.checkpoint)
+    output = os.path.abspath(opt.output) if opt.output else None
+
+    # The scripts read their data relative to their directory
+    os.chdir(os.path.join(sweep.ROOT, sweep.ENTRIES[opt.entry].dir))
+    module = sweep.import_entry(opt.entry)
+    model_opt = module.build_parser().parse_args(checkpoint["argv"])
+    if opt.entry == "hw2-q3":
+        task = Translator(module, model_opt, checkpoint["state_dict"])
+    else:
+        task = Classifier(opt.entry, module, model_opt, checkpoint["state_dict"])
+
+    int8_model = task.quantize(opt.calibration_size)
+
+    rows = []
+    for precision, model in (("fp32", task.model), ("int8", int8_model)):
+        valid, test = task.scores(model)
+        rows.append((precision, serialized_size(model),
+                     task.latency(model, opt.latency_batches, opt.batch_size), valid, test))
+
+    print('{:<6} {:>10} {:>13} {:>8} {:>8} {:>10}'.format(
+        'model', 'size (KB)', 'latency (ms)', 'valid', 'test', 'test diff'))
+    for precision, size, latency, valid, test in rows:
+        print('{:<6} {:>10.1f} {:>13.3f} {:>8.4f} {:>8.4f} {:>+10.4f}'.format(
+            precision, size / 1024, latency * 1000, valid, test, test - rows[0][4]))
+    print('{}: {}; int8 is {:.2f}x smaller and {:.2f}x faster'.format(
+        opt.entry, METRICS[opt.entry], rows[0][1] / rows[1][1], rows[0][2] / rows[1][2]))
+
+    if output:
+        torch.save(int8_model, output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,388 @@
+#!/usr/bin/env python
+
+# Hyperparameter sweeps for the homework entry points
+#
+# Runs every configuration of a grid (or of a JSON list of configurations)
+# through the main() of hw1-q1.py, hw1-q2.py, hw2-q2.py or hw2-q3.py in a
+# pool of worker processes. The classification data is loaded once and
+# handed to the workers through shared memory, results are cached on disk
+# under the config string each main() builds, and the optional budget mode
+# runs a successive-halving schedule that drops the weakest trials early.
+#
+# Example:
+#   python sweep.py hw1-q2 -grid model=mlp learning_rate=0.1,0.01,0.001 \
+#       hidden_size=100,200 dropout=0.3,0.5 activation=relu,tanh -workers 8
+
+import argparse
+import collections
+import concurrent.futures
+import functools
+import hashlib
+import importlib
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import sys
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# dir: where the script lives (and runs, since it reads and writes files
+#     relative to it)
+# prefix: how its optional flags are spelled
+# positional: config keys passed as positional arguments, in order
+# epochs: the flag holding the number of epochs
+# data: the load_classification_data() keyword arguments a run needs, or
+#     None if the script loads its own data
+# score: the validation score of a finished run, higher is better
+Entry = collections.namedtuple(
+    "Entry", ["dir", "prefix", "positional", "epochs", "data", "score"])
+
+ENTRIES = {
+    "hw1-q1": Entry(
+        "hw1/src", "-", ["model"], "epochs",
+        lambda opt: {"bias": opt.model != "mlp", "dtype": opt.dtype,
+                     "quantized": opt.quantized},
+        lambda result: result["valid_accs"][-1]),
+    "hw1-q2": Entry(
+        "hw1/src", "-", ["model"], "epochs",
+        lambda opt: {"dtype": "float32", "quantized": opt.quantized},
+        lambda result: result["valid_accs"][-1]),
+    "hw2-q2": Entry(
+        "hw2/src/cnn", "-", [], "epochs",
+        lambda opt: {"dtype": "float32", "quantized": opt.quantized},
+        lambda result: result["valid_accs"][-1]),
+    "hw2-q3": Entry(
+        "hw2/src/char", "--", [], "n_epochs",
+        None,
+        lambda result: -result["val_err_rates"][-1]),
+}
+
+# Options of the entry points that do not change the result of a run, left
+# out of the cache keys
+NEUTRAL_OPTIONS = {"mmap", "num_workers", "eval_chunk_size", "log_interval",
+                   "save_model", "node_rank", "master_addr", "master_port"}
+
+
+def import_entry(name):
+    """Imports an entry point script as a module (the names have dashes)."""
+    path = os.path.join(ROOT, ENTRIES[name].dir)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+    return importlib.import_module(name)
+
+
+def parse_value(value):
+    """Turns a command line grid value into an int, float, bool or str."""
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    if value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    return value
+
+
+def expand_grid(grid):
+    """
+    grid: list of "key=v1,v2,..." strings
+
+    Returns one config dict per element of the cartesian product.
+    """
+    keys, values = [], []
+    for item in grid:
+        key, _, vals = item.partition("=")
+        keys.append(key)
+        values.append([parse_value(v) for v in vals.split(",")])
+    return [dict(zip(keys, combo)) for combo in itertools.product(*values)]
+
+
+def to_argv(entry, config):
+    """Builds the command line of one config for an entry point."""
+    argv = [str(config[key]) for key in entry.positional if key in config]
+    for key, value in config.items():
+        if key in entry.positional:
+            continue
+        if value is True:
+            argv.append(entry.prefix + key)
+        elif value is not False:
+            argv.extend([entry.prefix + key, str(value)])
+    return argv
+
+
+def share_data(data):
+    """
+    Copies the arrays of a load_classification_data() dict into shared
+    memory blocks (the uint8 pixels of QuantizedFeatures). Returns the
+    blocks (which the caller must close and unlink) and a picklable spec for
+    attach_data().
+    """
+    blocks, spec = [], {}
+    for split, arrays in data.items():
+        spec[split] = []
+        for array in arrays:
+            # None for plain arrays, the bias flag of QuantizedFeatures
+            bias = None
+            if not isinstance(array, np.ndarray):
+                bias, array = array.bias, array.pixels
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+            shared[...] = array
+            blocks.append(block)
+            spec[split].append((block.name, array.shape, array.dtype.str, bias))
+    return blocks, spec
+
+
+def attach_data(spec, utils):
+    """
+    Maps the blocks described by a share_data() spec into this process and
+    returns them along with a load_classification_data()-like dict of
+    read-only arrays backed by them (no copy is made). utils is the module
+    whose QuantizedFeatures wrap quantized pixels.
+    """
+    blocks, data = [], {}
+    for split, arrays in spec.items():
+        views = []
+        for name, shape, dtype, bias in arrays:
+            block = shared_memory.SharedMemory(name=name)
+            view = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+            view.flags.writeable = False
+            if bias is not None:
+                view = utils.QuantizedFeatures(view, bias)
+            blocks.append(block)
+            views.append(view)
+        data[split] = tuple(views)
+    return blocks, data
+
+
+def init_worker(threads):
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+def run_trial(task):
+    """Runs one config in a worker process and returns its result dict."""
+    name, argv, spec = task
+    entry = ENTRIES[name]
+    os.chdir(os.path.join(ROOT, entry.dir))
+    module = import_entry(name)
+    start = time.perf_counter()
+    if spec is None:
+        result = module.main(argv)
+    else:
+        blocks, data = attach_data(spec, module.utils)
+        result = module.main(argv, data=data)
+        del data
+        for block in blocks:
+            block.close()
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def run_alone(task, threads):
+    """
+    run_trial(task) in a fresh process. Unlike those of a
+    multiprocessing.Pool, it is not a daemon, so the trial can start
+    processes of its own (hw1-q1.py -workers, hw1-q2.py and hw2-q2.py
+    -nproc).
+    """
+    ctx = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(
+            1, mp_context=ctx, initializer=init_worker,
+            initargs=(threads,)) as pool:
+        return pool.submit(run_trial, task).result()
+
+
+class Sweep(object):
+
+    def __init__(self, name, cache_dir, workers, threads):
+        self.name = name
+        self.entry = ENTRIES[name]
+        self.module = import_entry(name)
+        self.cache_dir = os.path.join(cache_dir, name)
+        self.workers = workers
+        self.threads = threads
+        # load_classification_data() kwargs -> (blocks, spec)
+        self.shared = {}
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def parse(self, argv):
+        return self.module.build_parser().parse_args(argv)
+
+    def key(self, opt):
+        """
+        Cache key: the config string main() builds and the epochs, which
+        keep the file names readable, plus a hash of every parsed option
+        but the NEUTRAL_OPTIONS, as config strings leave some out.
+        """
+        key = self.module.config_string(opt)
+        if "model" in self.entry.positional:
+            key = "{}-{}".format(opt.model, key)
+        options = {name: value for name, value in vars(opt).items()
+                   if name not in NEUTRAL_OPTIONS}
+        digest = hashlib.sha1(
+            json.dumps(options, sort_keys=True).encode()).hexdigest()[:12]
+        return "{}-{}epochs-{}".format(key, getattr(opt, self.entry.epochs), digest)
+
+    def cache_path(self, opt):
+        return os.path.join(self.cache_dir, self.key(opt) + ".json")
+
+    def spec(self, opt):
+        """Shares the data a config needs, loading each variant only once."""
+        if self.entry.data is None:
+            return None
+        kwargs = self.entry.data(opt)
+        frozen = tuple(sorted(kwargs.items()))
+        if frozen not in self.shared:
+            cwd = os.getcwd()
+            os.chdir(os.path.join(ROOT, self.entry.dir))
+            try:
+                data = self.module.utils.load_classification_data(**kwargs)
+            finally:
+                os.chdir(cwd)
+            self.shared[frozen] = share_data(data)
+        return self.shared[frozen][1]
+
+    def run(self, configs):
+        """
+        Runs every config (a list of argv lists) that is not cached yet and
+        returns a list of (argv, result) in the same order.
+        """
+        results = [None] * len(configs)
+        pending = []
+        for i, argv in enumerate(configs):
+            path = self.cache_path(self.parse(argv))
+            if os.path.exists(path):
+                with open(path) as f:
+                    results[i] = json.load(f)["result"]
+                print("cached: {}".format(" ".join(argv)))
+            else:
+                pending.append(i)
+
+        if pending:
+            tasks = [(self.name, configs[i], self.spec(self.parse(configs[i])))
+                     for i in pending]
+            # Every BLAS/OpenMP pool of a worker gets `threads` threads. The
+            # variables are read when the libraries load, which happens in
+            # the freshly spawned workers.
+            for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS",
+                        "OPENBLAS_NUM_THREADS"):
+                os.environ[var] = str(self.threads)
+            os.environ["MPLBACKEND"] = "Agg"
+            # Every trial gets a clean interpreter of its own (the entry
+            # points import a module called utils from different dirs), and
+            # up to `workers` of them run at once.
+            run = functools.partial(run_alone, threads=self.threads)
+            with concurrent.futures.ThreadPoolExecutor(self.workers) as pool:
+                for i, result in zip(pending, pool.map(run, tasks)):
+                    results[i] = result
+                    with open(self.cache_path(self.parse(configs[i])), "w") as f:
+                        json.dump({"argv": configs[i], "result": result}, f)
+                    print("done in {:.1f}s: {}".format(
+                        result["seconds"], " ".join(configs[i])))
+
+        return list(zip(configs, results))
+
+    def successive_halving(self, configs, min_epochs, eta):
+        """
+        Runs every config for min_epochs, keeps the best 1/eta of them, runs
+        those eta times longer, and so on until the survivors reach the
+        largest number of epochs any of the configs asks for, which all of
+        them are then trained for. Every rung trains its configs from
+        scratch.
+        """
+        max_epochs = max(getattr(self.parse(argv), self.entry.epochs) for argv in configs)
+        flag = self.entry.prefix + self.entry.epochs
+        survivors = []
+        for argv in configs:
+            if flag in argv:
+                i = argv.index(flag)
+                argv = argv[:i] + argv[i + 2:]
+            survivors.append(argv)
+
+        epochs = min_epochs
+        while True:
+            epochs = min(epochs, max_epochs)
+            print("rung: {} configs, {} epochs".format(len(survivors), epochs))
+            rung = [argv + [flag, str(epochs)] for argv in survivors]
+            results = self.run(rung)
+            if epochs == max_epochs:
+                return results
+            ranked = sorted(range(len(survivors)),
+                            key=lambda i: self.entry.score(results[i][1]),
+                            reverse=True)
+            n_keep = max(1, int(math.ceil(len(survivors) / eta)))
+            survivors = [survivors[i] for i in ranked[:n_keep]]
+            epochs *= eta
+
+    def close(self):
+        for blocks, _ in self.shared.values():
+            for block in blocks:
+                block.close()
+                block.unlink()
+        self.shared = {}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('entry', choices=sorted(ENTRIES),
+                        help="Which script should be swept?")
+    parser.add_argument('-grid', nargs='*', default=[],
+                        help="""key=v1,v2,... options whose cartesian product
+                        is swept, e.g. model=mlp learning_rate=0.1,0.01.
+                        Boolean flags take true/false.""")
+    parser.add_argument('-configs',
+                        help="""JSON file with a list of {key: value} configs,
+                        swept in addition to the grid""")
+    parser.add_argument('-workers', type=int, default=os.cpu_count(),
+                        help="Number of trials running at the same time.")
+    parser.add_argument('-threads', type=int, default=1,
+                        help="Number of threads each trial may use.")
+    parser.add_argument('-cache_dir', default=os.path.join(ROOT, 'sweep_cache'),
+                        help="Where the result of every finished trial is kept.")
+    parser.add_argument('-budget', action='store_true',
+                        help="""Successive halving: train every config for
+                        -min_epochs and only keep the best 1/-eta at each
+                        rung.""")
+    parser.add_argument('-min_epochs', type=int, default=1)
+    parser.add_argument('-eta', type=int, default=3)
+    opt = parser.parse_args()
+    if opt.budget and opt.min_epochs < 1:
+        parser.error('-min_epochs must be at least 1')
+    if opt.budget and opt.eta <= 1:
+        parser.error('-eta must be greater than 1')
+
+    entry = ENTRIES[opt.entry]
+    configs = expand_grid(opt.grid) if opt.grid else []
+    if opt.configs:
+        with open(opt.configs) as f:
+            configs.extend(json.load(f))
+    if not configs:
+        parser.error('nothing to sweep: pass -grid and/or -configs')
+    argvs = [to_argv(entry, config) for config in configs]
+
+    sweep = Sweep(opt.entry, opt.cache_dir, opt.workers, opt.threads)
+    try:
+        if opt.budget:
+            results = sweep.successive_halving(argvs, opt.min_epochs, opt.eta)
+        else:
+            results = sweep.run(argvs)
+    finally:
+        sweep.close()
+
+    print("\nscore     config")
+    for argv, result in sorted(results, key=lambda r: entry.score(r[1]), reverse=True):
+        print("{:<9.4f} {}".format(entry.score(result), " ".join(argv)))
+
+
+if __name__ == '__main__':
+    main()